@@ -0,0 +1,128 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import queue
+import time
+from typing import Callable
+from git_clone import clone_path
+import tracing
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+BATCH_SUMMARY = 'batch_summary.json'
+DEFAULT_PARALLEL_REPOSITORIES = 4
+
+
+def read_repos_file(path: str) -> list[tuple[str, str]]:
+    """Read the repositories of a batch, one per line: the url, optionally followed by the module to generate tests for.
+    Blank lines and lines starting with # are skipped
+
+    Args:
+        path (str): the repositories file
+
+    Returns:
+        list[tuple[str, str]]: url and module of every repository, the module is None for the whole repository
+    """
+    repositories = []
+    with open(path, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            repositories.append(
+                (fields[0], fields[1] if len(fields) > 1 else None))
+    return repositories
+
+
+def run_batch(repositories: list[tuple[str, str]], generate: Callable[[str, str], dict], parallel: int = DEFAULT_PARALLEL_REPOSITORIES,
+              summary_path: str = BATCH_SUMMARY) -> list[dict]:
+    """Generate tests for many repositories in one process. Workers take repositories from a shared queue, so one
+    repository's analysis and parsing overlap with another's LLM requests. A repository that fails is reported
+    and the others carry on
+
+    Args:
+        repositories (list[tuple[str, str]]): url and module of every repository
+        generate (Callable[[str, str], dict]): generates the tests of a url and module, and returns its summary
+        parallel (int): repositories worked on at once
+        summary_path (str): file the summary of every repository is written to
+
+    Returns:
+        list[dict]: summary of every repository, in the order of the repositories
+    """
+    # Entries cloned to the same directory, like the modules of a repository, are done one after the other by the
+    # same worker
+    groups = {}
+    for index, (repo_url, module) in enumerate(repositories):
+        groups.setdefault(clone_path(repo_url), []).append(
+            (index, repo_url, module))
+    work = queue.Queue()
+    for entries in groups.values():
+        work.put(entries)
+    summaries = [None] * len(repositories)
+
+    def worker():
+        while True:
+            try:
+                entries = work.get_nowait()
+            except queue.Empty:
+                return
+            for index, repo_url, module in entries:
+                summaries[index] = run_repository(generate, repo_url, module)
+
+    parallel = max(1, min(parallel, len(groups)))
+    logging.info(
+        f'Generating tests for {len(repositories)} repositories, {parallel} at a time')
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='repository') as executor:
+        for future in [executor.submit(worker) for _ in range(parallel)]:
+            future.result()
+
+    failed = [summary for summary in summaries if summary['status'] == 'failed']
+    with open(summary_path, 'w') as file:
+        json.dump(summaries, file, indent=4)
+    logging.info(
+        f'Finished {len(summaries) - len(failed)} of {len(summaries)} repositories, summary in {summary_path}')
+    for summary in failed:
+        logging.error(
+            f'{summary["repository"]} failed: {summary["error"]}')
+    return summaries
+
+
+def run_repository(generate: Callable[[str, str], dict], repo_url: str, module: str) -> dict:
+    """Generate the tests of one repository of a batch, turning any failure into its summary
+
+    Args:
+        generate (Callable[[str, str], dict]): generates the tests of a url and module, and returns its summary
+        repo_url (str): URL to the git repo
+        module (str): module to generate tests for, None for the whole repository
+
+    Returns:
+        dict: summary of the repository, with its 'status' and how long it took
+    """
+    start = time.monotonic()
+    summary = {'repository': repo_url, 'module': module}
+    try:
+        with tracing.span('repository', repository=repo_url, module=module):
+            summary.update(generate(repo_url, module))
+    # Fatal errors exit, which only ends this repository
+    except (Exception, SystemExit) as e:
+        logging.exception(f'Generating tests for {repo_url} failed')
+        summary.update(status='failed',
+                       error=f'{type(e).__name__}: {e}')
+    summary['seconds'] = round(time.monotonic() - start, 1)
+    logging.info(
+        f'{summary["status"].capitalize()} {repo_url}{f" ({module})" if module else ""} in {summary["seconds"]}s')
+    return summary
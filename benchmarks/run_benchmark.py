@@ -0,0 +1,264 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+import platform
+import random
+import resource
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import git
+import llm
+import preprocess as preprocess_module
+from llm_backends import LocalBackend
+from llm_client import LLMClient
+from pipeline import buffered
+from postprocess import postprocess
+from preprocess import iter_packages, preprocess
+from prompt_artifacts import PromptArtifactSink
+from prompt_profile import percentile
+from prompt_template import PromptTemplate
+from prompts import fill_out_prompts, iter_prompts
+from benchmarks.synthetic_repo import RepositoryShape, generate_repository
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+REPOSITORY_DIRECTORY = 'target_repository/benchmark'
+ISSUE_MESSAGES = ('Remove this unused private method.', 'Define a constant instead of duplicating this literal.',
+                  'Refactor this method to reduce its Cognitive Complexity.', 'Make this field final.')
+RESULTS_DIRECTORY = 'benchmarks/results'
+
+
+class TimedChat:
+    def __init__(self, backend, chat) -> None:
+        self.backend = backend
+        self.chat = chat
+
+    def send_message(self, question: str, **parameters):
+        start = time.perf_counter()
+        response = self.chat.send_message(question, **parameters)
+        self.backend.record(time.perf_counter() - start)
+        return response
+
+
+class TimedBackend:
+    def __init__(self, inner) -> None:
+        """Records how long every request to another backend takes
+
+        Args:
+            inner: backend that answers the requests
+        """
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def start_chat(self, context: str) -> TimedChat:
+        return TimedChat(self, self.inner.start_chat(context))
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def reset(self) -> list[float]:
+        with self.lock:
+            latencies, self.latencies = self.latencies, []
+        return latencies
+
+
+def setup() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='Test Generation Benchmark',
+        description='Times every stage of test generation on a synthetic repository, with a local LLM and canned Sonarqube results')
+    parser.add_argument('--modules', type=int, default=2)
+    parser.add_argument('--packages', type=int, default=4,
+                        help='Packages in every module')
+    parser.add_argument('--files', type=int, default=10,
+                        help='Source files in every package')
+    parser.add_argument('--methods', type=int, default=8,
+                        help='Methods of every class')
+    parser.add_argument('--nested-classes', type=int, default=1,
+                        help='Static classes nested in every class')
+    parser.add_argument('--javadoc-density', type=float, default=0.5,
+                        help='Fraction of classes, methods and fields with Javadoc')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--issues-per-file', type=int, default=5,
+                        help='Static analysis issues the stand-in for Sonarqube reports in every source file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes parsing the source files')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Requests in flight to the LLM at once')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Average seconds the local LLM takes to respond')
+    parser.add_argument('--output',
+                        help='File to write the report to, defaults to benchmarks/results/<commit>.json')
+    return parser.parse_args()
+
+
+def canned_analysis(issues_per_file: int, seed: int):
+    """Stand-in for the Sonarqube analysis, so the stages handling its results are measured without a server
+
+    Args:
+        issues_per_file (int): issues reported in every source file
+        seed (int): seed of the lines and messages of the issues
+
+    Returns:
+        function with the signature of static_code_analysis.analyze, reporting issues on random lines of every file
+    """
+    def analyze(directory: Path, stop_sonar: bool = False, use_cache: bool = True) -> dict:
+        rng = random.Random(seed)
+        results = {}
+        for path in sorted(Path(directory).absolute().rglob('*.java')):
+            lines = path.read_text().count('\n') + 1
+            issues = [{'line': rng.randint(1, lines), 'message': rng.choice(ISSUE_MESSAGES)}
+                      for _ in range(issues_per_file)]
+            # File level issues have no line, like in parse_results
+            issues.append({'line': None, 'message': 'Add a private constructor to hide the implicit public one.'})
+            results[str(path)] = sorted(
+                issues, key=lambda issue: issue['line'] or 0)
+        return results
+    return analyze
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of the whole process and its finished children so far, in MB. It only goes up, so the
+    peak of a stage is only visible as an increase if the stage used more memory than the ones before it
+
+    Returns:
+        float: process wide peak RSS
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KB on linux, bytes on macOS
+    scale = 1024 * 1024 if platform.system() == 'Darwin' else 1024
+    return round(max(own, children) / scale, 1)
+
+
+def stage_result(seconds: float, items: int, unit: str, latencies: list[float] = None, rss_before: float = None) -> dict:
+    peak = peak_rss_mb()
+    result = {'seconds': round(seconds, 3),
+              unit: items,
+              f'{unit}_per_second': round(items / seconds, 2) if seconds else None,
+              'process_peak_rss_mb': peak}
+    if rss_before is not None:
+        result['process_peak_rss_increase_mb'] = round(peak - rss_before, 1)
+    if latencies:
+        latencies = sorted(latencies)
+        for percent in (50, 90, 99):
+            result[f'latency_p{percent}'] = round(
+                percentile(latencies, percent), 4)
+    return result
+
+
+def commit_info() -> dict:
+    repo = git.Repo(Path(__file__).parent, search_parent_directories=True)
+    return {'commit': repo.head.commit.hexsha,
+            'dirty': repo.is_dirty(untracked_files=False)}
+
+
+def run_stages(repository: Path, args: argparse.Namespace, backend: TimedBackend) -> dict:
+    """Run every stage on its own, one after the other, then the whole streamed pipeline
+
+    Args:
+        repository (Path): root of the synthetic repository
+        args (argparse.Namespace): benchmark settings
+        backend (TimedBackend): local LLM backend in use
+
+    Returns:
+        dict: results of every stage
+    """
+    template = PromptTemplate()
+    stages = {}
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    packages = preprocess(repository, workers=args.workers)
+    files = sum(len(package.source_code) for package in packages)
+    stages['preprocess'] = stage_result(
+        time.perf_counter() - start, files, 'files', rss_before=rss_before)
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    prompts = fill_out_prompts(packages, template=template,
+                               artifacts=PromptArtifactSink('off'))
+    prompt_count = sum(len(file_prompts) for file_prompts in prompts.values())
+    stages['fill_out_prompts'] = stage_result(
+        time.perf_counter() - start, prompt_count, 'prompts', rss_before=rss_before)
+
+    backend.reset()
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    results = llm.generate_tests(prompts, concurrency=args.concurrency,
+                                 client=LLMClient(requests_per_minute=None))
+    stages['generate_tests'] = stage_result(
+        time.perf_counter() - start, prompt_count, 'prompts', backend.reset(), rss_before)
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    postprocess(results.items())
+    stages['postprocess'] = stage_result(
+        time.perf_counter() - start, len(results), 'files', rss_before=rss_before)
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    streamed_packages = buffered(iter_packages(
+        repository, workers=args.workers), maxsize=2)
+    streamed_prompts = buffered(iter_prompts(streamed_packages, template=template,
+                                             artifacts=PromptArtifactSink('off')), maxsize=args.concurrency * 4)
+    postprocess(llm.iter_tests(streamed_prompts, concurrency=args.concurrency,
+                               client=LLMClient(requests_per_minute=None)))
+    stages['pipeline'] = stage_result(
+        time.perf_counter() - start, prompt_count, 'prompts', backend.reset(), rss_before)
+    return stages
+
+
+def run():
+    args = setup()
+    shape = RepositoryShape(args.modules, args.packages, args.files, args.methods,
+                            args.nested_classes, args.javadoc_density, args.seed)
+    repository = Path(REPOSITORY_DIRECTORY)
+    generate_repository(repository, shape)
+
+    backend = TimedBackend(LocalBackend(args.latency))
+    llm.use_backend(backend)
+    preprocess_module.analyze = canned_analysis(
+        args.issues_per_file, args.seed)
+    stages = run_stages(repository.absolute(), args, backend)
+
+    info = commit_info()
+    report = dict(info,
+                  timestamp=datetime.now(timezone.utc).isoformat(),
+                  python=platform.python_version(),
+                  shape=shape.to_dict(),
+                  settings={'workers': args.workers,
+                            'issues_per_file': args.issues_per_file,
+                            'concurrency': args.concurrency,
+                            'latency': args.latency},
+                  stages=stages)
+    output = Path(args.output or Path(RESULTS_DIRECTORY).joinpath(
+        f'{info["commit"][:12]}.json'))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=4)
+    logging.info(f'Wrote benchmark results to {output}')
+    for name, result in stages.items():
+        logging.info(f'{name}: {result}')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,149 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import shutil
+from pathlib import Path
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+TYPES = ('int', 'long', 'String', 'boolean', 'double', 'List<String>')
+VALUES = {'int': '0', 'long': '0L', 'String': '""', 'boolean': 'false',
+          'double': '0.0', 'List<String>': 'new ArrayList<>()'}
+
+POM = '''<project xmlns="http://maven.apache.org/POM/4.0.0">
+    <modelVersion>4.0.0</modelVersion>
+    <groupId>com.bench</groupId>
+    <artifactId>{artifact}</artifactId>
+    <version>1.0</version>
+</project>
+'''
+
+
+class RepositoryShape:
+    def __init__(self, modules: int = 2, packages: int = 4, files: int = 10, methods: int = 8,
+                 nested_classes: int = 1, javadoc_density: float = 0.5, seed: int = 0) -> None:
+        """Size of a synthetic repository
+
+        Args:
+            modules (int): maven modules
+            packages (int): packages in every module
+            files (int): source files in every package
+            methods (int): methods of every class
+            nested_classes (int): static classes nested in every class
+            javadoc_density (float): fraction of classes, methods and fields with a Javadoc comment
+            seed (int): seed of the random choices, the same shape always generates the same repository
+        """
+        self.modules = modules
+        self.packages = packages
+        self.files = files
+        self.methods = methods
+        self.nested_classes = nested_classes
+        self.javadoc_density = javadoc_density
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def javadoc(rng: random.Random, density: float, indent: str, text: str) -> str:
+    if rng.random() >= density:
+        return ''
+    return f'{indent}/**\n{indent} * {text}\n{indent} *\n{indent} * @since 1.0\n{indent} */\n'
+
+
+def generate_method(rng: random.Random, shape: RepositoryShape, indent: str, index: int, fields: list[tuple]) -> str:
+    ret_val = rng.choice(TYPES + ('void',))
+    parameters = [(rng.choice(TYPES), f'arg{i}')
+                  for i in range(rng.randint(0, 3))]
+    field_type, field_name = rng.choice(fields)
+    access = rng.choice(('public', 'public', 'protected', 'private'))
+    body = [f'{indent}    if ({field_name} == null) {{',
+            f'{indent}        throw new IllegalStateException("{field_name} is not set");',
+            f'{indent}    }}']
+    for parameter_type, parameter_name in parameters:
+        if parameter_type == 'int':
+            body.append(
+                f'{indent}    for (int i = 0; i < {parameter_name}; i++) {{ counter += i; }}')
+    if ret_val != 'void':
+        body.append(f'{indent}    return {VALUES[ret_val]};')
+    signature = ', '.join(f'{parameter_type} {parameter_name}' for parameter_type,
+                          parameter_name in parameters)
+    comment = javadoc(rng, shape.javadoc_density, indent,
+                      f'Operation number {index}.')
+    return (f'{comment}{indent}{access} {ret_val} operation{index}({signature}) {{\n'
+            + '\n'.join(body) + f'\n{indent}}}\n')
+
+
+def generate_class(rng: random.Random, shape: RepositoryShape, name: str, indent: str, modifiers: str, nested: int) -> str:
+    fields = [(rng.choice(('String', 'List<String>')), f'field{i}')
+              for i in range(3)]
+    lines = [javadoc(rng, shape.javadoc_density, indent, f'The {name} class.'),
+             f'{indent}public {modifiers}class {name} {{\n']
+    lines.append(f'{indent}    private int counter;\n')
+    for field_type, field_name in fields:
+        lines.append(javadoc(rng, shape.javadoc_density,
+                     indent + '    ', f'The {field_name}.'))
+        lines.append(f'{indent}    private {field_type} {field_name};\n')
+    lines.append(
+        f'\n{indent}    public {name}() {{\n{indent}        this.counter = 0;\n{indent}    }}\n\n')
+    for i in range(shape.methods):
+        lines.append(generate_method(rng, shape, indent + '    ', i, fields))
+        lines.append('\n')
+    for i in range(nested):
+        lines.append(generate_class(rng, shape, f'{name}Part{i}',
+                     indent + '    ', 'static ', 0))
+    lines.append(f'{indent}}}\n')
+    return ''.join(lines)
+
+
+def generate_file(rng: random.Random, shape: RepositoryShape, package: str, name: str) -> str:
+    header = (f'package {package};\n\n'
+              'import java.util.ArrayList;\n'
+              'import java.util.List;\n\n')
+    return header + generate_class(rng, shape, name, '', '', shape.nested_classes)
+
+
+def generate_repository(directory: Path, shape: RepositoryShape) -> int:
+    """Write a synthetic maven repository, replacing anything already in the directory
+
+    Args:
+        directory (Path): root of the repository
+        shape (RepositoryShape): size of the repository
+
+    Returns:
+        int: number of java files written
+    """
+    rng = random.Random(shape.seed)
+    if directory.exists():
+        shutil.rmtree(directory)
+    count = 0
+    for module in range(shape.modules):
+        module_dir = directory.joinpath(f'module{module}')
+        module_dir.mkdir(parents=True)
+        with open(module_dir.joinpath('pom.xml'), 'w') as file:
+            file.write(POM.format(artifact=f'module{module}'))
+        for package_index in range(shape.packages):
+            package = f'com.bench.m{module}.p{package_index}'
+            package_dir = module_dir.joinpath(
+                'src', 'main', 'java', *package.split('.'))
+            package_dir.mkdir(parents=True)
+            for file_index in range(shape.files):
+                name = f'Service{file_index}'
+                with open(package_dir.joinpath(f'{name}.java'), 'w') as file:
+                    file.write(generate_file(rng, shape, package, name))
+                count += 1
+    logging.info(f'Generated {count} java files in {directory}')
+    return count
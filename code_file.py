@@ -12,12 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 from method import Method
 from pathlib import Path
 
 
 class CodeFile:
-    def __init__(self, class_signatures: list[dict], class_comments: list[str], fields: list[str], methods: list[Method], path: Path, package: str, imports: list[str], static_code_analysis: list[str]) -> None:
+    def __init__(self, class_signatures: list[dict], class_comments: list[str], fields: list[str], methods: list[Method], path: Path, package: str, imports: list[str], static_code_analysis: list[dict]) -> None:
         self.class_signatures = class_signatures
         self.class_comments = class_comments
         self.fields = fields
@@ -25,4 +26,21 @@ class CodeFile:
         self.path = path
         self.package = package
         self.imports = imports
+        # Issues sorted by line, with file level issues (no line) first
         self.static_code_analysis = static_code_analysis
+        self._issue_lines = [issue['line'] or 0 for issue in static_code_analysis]
+
+    def issues_for(self, method: Method) -> list[str]:
+        """Static code analysis messages for the lines of a method
+
+        Args:
+            method (Method): method in this file
+
+        Returns:
+            list[str]: messages of the issues inside the method, all messages if its lines are unknown
+        """
+        if method.start_line is None or method.end_line is None:
+            return [issue['message'] for issue in self.static_code_analysis]
+        first = bisect.bisect_left(self._issue_lines, method.start_line)
+        last = bisect.bisect_right(self._issue_lines, method.end_line)
+        return [issue['message'] for issue in self.static_code_analysis[first:last]]
@@ -0,0 +1,205 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+import json
+import os
+from pathlib import Path
+import re
+import subprocess
+import tempfile
+import tracing
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+COMPILE_REPORT = 'compile_report.json'
+QUARANTINE_SUFFIX = '.quarantined'
+ERROR_PATTERN = re.compile(r'^(?P<file>.+?\.java):(?P<line>\d+): error: (?P<message>.*)$', re.MULTILINE)
+
+
+def find_module_root(path: Path) -> Path:
+    """Find the maven module a file belongs to
+
+    Args:
+        path (Path): path of a file in the module
+
+    Returns:
+        Path: closest directory above the file with a pom.xml, None if there is none
+    """
+    for directory in path.absolute().parents:
+        if directory.joinpath('pom.xml').is_file():
+            return directory
+    return None
+
+
+def resolve_classpath(module_root: Path) -> str:
+    """Compile the main classes of a module and resolve its test classpath, in 1 maven invocation
+
+    Args:
+        module_root (Path): directory of the module's pom.xml
+
+    Returns:
+        str: classpath the tests of the module compile against, None if maven failed
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        classpath_file = Path(directory).joinpath('classpath.txt')
+        with tracing.span('resolve_classpath', module=str(module_root)):
+            result = subprocess.run(
+                ['mvn', '-q', '-B', 'compile', 'dependency:build-classpath',
+                 '-Dmdep.includeScope=test', f'-Dmdep.outputFile={classpath_file}'],
+                cwd=module_root, capture_output=True, text=True)
+        if result.returncode != 0 or not classpath_file.is_file():
+            logging.error(
+                f'Failed resolving the classpath of {module_root}: {result.stdout[-2000:]}{result.stderr[-2000:]}')
+            return None
+        classpath = classpath_file.read_text().strip()
+    classes = str(module_root.joinpath('target', 'classes'))
+    return os.pathsep.join(part for part in (classes, classpath) if part)
+
+
+def parse_errors(output: str) -> dict:
+    """Group javac error messages by file
+
+    Args:
+        output (str): what javac printed
+
+    Returns:
+        dict: absolute file path to its errors, each a dict with the line and message
+    """
+    errors = defaultdict(list)
+    for match in ERROR_PATTERN.finditer(output):
+        errors[str(Path(match.group('file')).absolute())].append(
+            {'line': int(match.group('line')), 'message': match.group('message').strip()})
+    return dict(errors)
+
+
+def compile_module(module_root: Path, files: list[Path], classpath: str) -> dict:
+    """Compile the generated tests of a module, all of them in each javac invocation so the JVM starts once a pass.
+    javac stops before type checking when any file has a syntax error, so the files that failed are left out and
+    the rest compiled again, until a pass is clean
+
+    Args:
+        module_root (Path): directory of the module's pom.xml
+        files (list[Path]): generated test files of the module
+        classpath (str): classpath of the module's tests
+
+    Returns:
+        dict: absolute file path to its errors, for the files that do not compile
+    """
+    failures = {}
+    while files:
+        errors = compile_files(module_root, files, classpath)
+        if not errors:
+            break
+        failures.update(errors)
+        files = [file for file in files if str(file.absolute()) not in errors]
+    return failures
+
+
+def compile_files(module_root: Path, files: list[Path], classpath: str) -> dict:
+    """Compile files in a single javac invocation
+
+    Args:
+        module_root (Path): directory of the module's pom.xml
+        files (list[Path]): generated test files of the module
+        classpath (str): classpath of the module's tests
+
+    Returns:
+        dict: absolute file path to its errors, for the files that do not compile
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        # The file list goes in an argument file, so any number of files fits on the command line
+        arguments_file = Path(directory).joinpath('sources.txt')
+        arguments_file.write_text('\n'.join(
+            f'"{file.absolute().as_posix()}"' for file in files))
+        command = ['javac', '-d', str(Path(directory).joinpath('classes')), '-proc:none', '-nowarn',
+                   '-encoding', 'UTF-8', '-Xmaxerrs', '100000', '-cp', classpath,
+                   '-sourcepath', str(module_root.joinpath('src', 'test', 'java')),
+                   f'@{arguments_file}']
+        with tracing.span('javac', module=str(module_root), files=len(files)):
+            result = subprocess.run(command, cwd=module_root,
+                                    capture_output=True, text=True)
+    if result.returncode == 0:
+        return {}
+    errors = parse_errors(result.stderr)
+    generated = {str(file.absolute()) for file in files}
+    # Only the generated tests are reported, errors in files they pulled in from the sourcepath are not theirs
+    generated_errors = {file: file_errors for file,
+                        file_errors in errors.items() if file in generated}
+    if not generated_errors:
+        logging.error(
+            f'javac failed for {module_root} outside of the generated tests: {result.stderr[-2000:]}')
+    return generated_errors
+
+
+def quarantine(file: Path) -> Path:
+    """Move a test that does not compile out of the way of the build
+
+    Args:
+        file (Path): the test file
+
+    Returns:
+        Path: where the file was moved
+    """
+    target = file.with_name(file.name + QUARANTINE_SUFFIX)
+    os.replace(file, target)
+    return target
+
+
+def validate_tests(test_files: list[Path], quarantine_failures: bool = False, report: str = COMPILE_REPORT) -> dict:
+    """Compile the generated tests, module by module, and report the files that do not compile
+
+    Args:
+        test_files (list[Path]): generated test files
+        quarantine_failures (bool): rename files that do not compile so maven skips them
+        report (str): file the per file errors are written to, None to only return them
+
+    Returns:
+        dict: absolute file path to its errors, for the files that do not compile
+    """
+    modules = defaultdict(list)
+    for file in test_files:
+        module_root = find_module_root(file)
+        if module_root is None:
+            logging.warning(f'{file} is not in a maven module, not compiling it')
+            continue
+        modules[module_root].append(file)
+
+    failures = {}
+    compiled = 0
+    try:
+        for module_root, files in modules.items():
+            classpath = resolve_classpath(module_root)
+            if classpath is None:
+                continue
+            logging.info(
+                f'Compiling {len(files)} generated test(s) in {module_root}')
+            failures.update(compile_module(module_root, files, classpath))
+            compiled += len(files)
+    except FileNotFoundError as e:
+        logging.error(f'Could not validate the generated tests, {e.filename} is not installed')
+        return failures
+
+    for file in sorted(failures):
+        logging.warning(
+            f'{file} does not compile: {failures[file][0]["message"]} (line {failures[file][0]["line"]})')
+        if quarantine_failures and Path(file).is_file():
+            quarantine(Path(file))
+    logging.info(
+        f'{compiled - len(failures)} of {compiled} generated test file(s) compile')
+    if report:
+        with open(report, 'w') as file:
+            json.dump(failures, file, indent=4)
+    return failures
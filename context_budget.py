@@ -0,0 +1,136 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+# Rough average for code and json, the model does not expose its tokenizer
+CHARS_PER_TOKEN = 4
+# Long comments are cut down to this many characters before they are dropped
+COMMENT_LIMIT = 400
+# Fields of the target method that are never pruned
+PROTECTED_KEYS = ('target_method_body', 'target_method_signature')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate how many tokens a piece of text is
+
+    Args:
+        text (str): text sent to the LLM
+
+    Returns:
+        int: estimated token count
+    """
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def json_tokens(value) -> int:
+    return estimate_tokens(json.dumps(value))
+
+
+def find_parent(context: dict, key: str) -> dict:
+    """Find the (possibly nested) dict of the context holding a key
+
+    Args:
+        context (dict): prompt context
+        key (str): key to look for
+
+    Returns:
+        dict: the dict holding the key, None if it is not in the context
+    """
+    if key in context:
+        return context
+    for value in context.values():
+        if isinstance(value, dict):
+            parent = find_parent(value, key)
+            if parent is not None:
+                return parent
+    return None
+
+
+def fit_context(prompt: dict, budget: int) -> dict:
+    """Shrink the context of a prompt until it fits in a token budget. The lowest priority sections go first:
+    imports and comments of the reference classes, reference classes not mentioned by the target method,
+    static code analysis messages, the remaining reference classes, long comments, and finally the class imports.
+    The target method body and signature are always kept
+
+    Args:
+        prompt (dict): rendered prompt with its 'question' and 'context'
+        budget (int): maximum estimated tokens for the question and context together
+
+    Returns:
+        dict: the prompt, or a pruned copy of it if it was over budget
+    """
+    context = prompt['context']
+    total = estimate_tokens(prompt['question']) + json_tokens(context)
+    if total <= budget:
+        return prompt
+
+    context = dict(context)
+    for key, value in context.items():
+        if isinstance(value, dict):
+            context[key] = dict(value)
+    # The reference items are shared by every prompt of the package, so they are copied before changing them
+    references = [dict(item)
+                  for item in context.get('reference_package_info', [])]
+    context['reference_package_info'] = references
+
+    def replace(parent: dict, key: str, value) -> bool:
+        nonlocal total
+        if parent is None or key not in parent or key in PROTECTED_KEYS:
+            return False
+        total -= json_tokens(parent[key]) - json_tokens(value)
+        parent[key] = value
+        return total <= budget
+
+    def drop_references(items: list[dict]) -> bool:
+        nonlocal total
+        for item in sorted(items, key=json_tokens, reverse=True):
+            # Also drops the separator between items
+            total -= json_tokens(item) + 1
+            references.remove(item)
+            if total <= budget:
+                return True
+        return False
+
+    for key in ('class_imports', 'class_comments'):
+        for item in references:
+            if replace(item, key, ''):
+                return dict(prompt, context=context)
+
+    target = ' '.join(str(find_parent(context, key)[key]) for key in PROTECTED_KEYS + ('class_signature',)
+                      if find_parent(context, key) is not None)
+    distant = [item for item in references
+               if item.get('class_name') and item['class_name'] not in target]
+    if drop_references(distant):
+        return dict(prompt, context=context)
+    if replace(find_parent(context, 'static_code_analysis'), 'static_code_analysis', ''):
+        return dict(prompt, context=context)
+    if drop_references(list(references)):
+        return dict(prompt, context=context)
+
+    for key in ('class_comments', 'target_method_comment'):
+        parent = find_parent(context, key)
+        if parent is not None and len(str(parent[key])) > COMMENT_LIMIT:
+            if replace(parent, key, str(parent[key])[:COMMENT_LIMIT]):
+                return dict(prompt, context=context)
+    for key in ('class_comments', 'class_imports', 'code_imports'):
+        if replace(find_parent(context, key), key, ''):
+            return dict(prompt, context=context)
+
+    logging.warning(
+        f'Prompt for {context.get("test_name", "a method")} is still about {total} tokens, over the budget of {budget}')
+    return dict(prompt, context=context)
@@ -12,37 +12,249 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
 import os
-from git import Repo
+import threading
+from git import Repo, GitCommandError
 from pathlib import Path
 from logging_config import configure_logging
 import logging
 TARGET_DIRECTORY = 'target_repository'
+LAST_COMMITS_FILE = os.path.join(TARGET_DIRECTORY, 'last_generated_commits.json')
+MIRROR_DIRECTORY = os.path.join(TARGET_DIRECTORY, '.mirrors')
+_commits_lock = threading.Lock()
 configure_logging()
 
 
-def clone_or_update_repository(repo_url: str) -> Path:
-    """Clone/update the git repository you added to the command
+def clone_or_update_repository(repo_url: str, module: str = None, history: bool = False, full: bool = False, mirror: bool = True) -> Path:
+    """Clone/update the git repository you added to the command. Only what the run needs is downloaded: a module
+    gets a sparse checkout of its directory, and history is only fetched when changes have to be looked up.
+    An existing clone is fetched and fast-forwarded
 
     Args:
         repo_url (str): URL to the git repo
+        module (str): path of the module tests are generated for, relative to the repository root. None for all of it
+        history (bool): fetch the commit history, to find the files changed since a commit
+        full (bool): clone the full history and every directory, like a plain git clone
+        mirror (bool): borrow the commits and trees of the history from a shared mirror of the remote, so they are
+            downloaded once for every run that needs them
 
     Returns:
         Path: Path to the repository that was cloned/updated
     """
-    repo_name = repo_url.split('/')[-1].replace('.git', '')
-    repo_path = os.path.join(TARGET_DIRECTORY, repo_name)
+    repo_path = clone_path(repo_url)
     logging.info(f'Preparing to clone {repo_url}')
     # Check if the repository directory exists
     if os.path.exists(repo_path):
-        return check_if_cloned(repo_url, repo_path)
+        path = check_if_cloned(repo_url, repo_path)
+        repo = Repo(repo_path)
+        if mirror and references_mirror(repo, repo_url):
+            update_mirror(repo_url)
+        prepare_checkout(repo, module, history, full)
+        update_clone(repo)
+        return path
 
     # Clone the repository
-    Repo.clone_from(repo_url, repo_path)
-    logging.info(f"Successfully cloned {repo_url} into {repo_path}")
+    options = clone_options(module, history, full)
+    # Shallow clones already download the least they can, and full clones need the blobs the mirror leaves out
+    if mirror and history and not full:
+        reference = update_mirror(repo_url)
+        if reference:
+            options['reference'] = reference
+    repo = Repo.clone_from(repo_url, repo_path, **options)
+    if options.get('sparse'):
+        repo.git.sparse_checkout('set', '--cone', sparse_path(module))
+    logging.info(
+        f"Successfully cloned {repo_url} into {repo_path} ({', '.join(options) or 'full clone'})")
     return Path(repo_path)
 
 
+def clone_path(repo_url: str) -> str:
+    """Where a repository is cloned
+
+    Args:
+        repo_url (str): URL to the git repo
+
+    Returns:
+        str: path of the clone, named after the repository
+    """
+    repo_name = repo_url.split('/')[-1].replace('.git', '')
+    return os.path.join(TARGET_DIRECTORY, repo_name)
+
+
+def clone_options(module: str, history: bool, full: bool) -> dict:
+    """Options of git clone for a run
+
+    Args:
+        module (str): path of the module tests are generated for, None for the whole repository
+        history (bool): the commit history is needed
+        full (bool): clone everything
+
+    Returns:
+        dict: keyword arguments for Repo.clone_from
+    """
+    if full:
+        return {}
+    options = {}
+    if history:
+        # Every commit and tree, but file contents are only downloaded when they are checked out or diffed
+        options['filter'] = 'blob:none'
+    else:
+        options['depth'] = 1
+    if module:
+        # Only the module and the build files of the directories above it are checked out
+        options['filter'] = 'blob:none'
+        options['sparse'] = True
+    return options
+
+
+def mirror_path(repo_url: str) -> str:
+    repo_name = repo_url.rstrip('/').split('/')[-1].replace('.git', '')
+    url_hash = hashlib.sha1(repo_url.encode('utf-8')).hexdigest()[:12]
+    return os.path.abspath(os.path.join(MIRROR_DIRECTORY, f'{repo_name}-{url_hash}.git'))
+
+
+@contextmanager
+def locked(path: str):
+    """Hold an exclusive lock on a file, so parallel runs take turns
+
+    Args:
+        path (str): lock file, created if it does not exist
+    """
+    with open(path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def references_mirror(repo: Repo, repo_url: str) -> bool:
+    """Whether a clone borrows objects from the mirror of its remote
+
+    Args:
+        repo (Repo): the clone
+        repo_url (str): URL to the git repo
+
+    Returns:
+        bool: True if the mirror is one of the clone's alternates
+    """
+    alternates = os.path.join(repo.git_dir, 'objects', 'info', 'alternates')
+    if not os.path.isfile(alternates):
+        return False
+    with open(alternates, 'r') as file:
+        return os.path.join(mirror_path(repo_url), 'objects') in file.read().splitlines()
+
+
+def update_mirror(repo_url: str) -> str:
+    """Create or fetch the shared bare mirror of a remote. It only holds the commits and trees, blobs are fetched
+    by the blobless clones that reference it when they check them out
+
+    Args:
+        repo_url (str): URL to the git repo
+
+    Returns:
+        str: absolute path of the mirror, None if it could not be updated
+    """
+    path = mirror_path(repo_url)
+    os.makedirs(MIRROR_DIRECTORY, exist_ok=True)
+    try:
+        with locked(f'{path}.lock'):
+            if os.path.isdir(path):
+                Repo(path).git.fetch('--prune', 'origin')
+            else:
+                logging.info(f'Creating a mirror of {repo_url} in {path}')
+                mirror = Repo.clone_from(
+                    repo_url, path, mirror=True, filter='blob:none')
+                # Clones borrow objects from the mirror, it must never drop them
+                with mirror.config_writer() as config:
+                    config.set_value('gc', 'auto', 0)
+                    config.set_value('gc', 'pruneExpire', 'never')
+    except GitCommandError as e:
+        logging.warning(f'Could not update the mirror of {repo_url}: {e}')
+        return None
+    return path
+
+
+def update_clone(repo: Repo):
+    """Fetch the remote and fast-forward the checked out branch. Local changes are kept, and a clone that
+    can not be fast-forwarded is left as it is
+
+    Args:
+        repo (Repo): the existing clone
+    """
+    if repo.head.is_detached:
+        logging.info(
+            f'{repo.working_dir} is not on a branch, not updating it')
+        return
+    tracking = repo.active_branch.tracking_branch()
+    if tracking is None:
+        return
+    shallow = os.path.isfile(os.path.join(repo.git_dir, 'shallow'))
+    try:
+        repo.git.fetch('origin', *(['--depth=1'] if shallow else []))
+        current = repo.head.commit
+        latest = tracking.commit
+        if current == latest:
+            logging.info(f'{repo.working_dir} is up to date')
+            return
+        if repo.is_ancestor(current, latest):
+            repo.git.merge('--ff-only', tracking.name)
+        elif shallow:
+            # The fetched commit has no history to connect it with, so move onto it keeping local changes
+            repo.git.reset('--keep', tracking.name)
+        else:
+            logging.warning(
+                f'{repo.working_dir} has diverged from {tracking.name}, not updating it')
+            return
+    except GitCommandError as e:
+        logging.warning(
+            f'Could not update {repo.working_dir}, continuing with what is checked out: {e}')
+        return
+    logging.info(
+        f'Updated {repo.working_dir} to {repo.head.commit.hexsha[:10]}')
+
+
+def sparse_path(module: str) -> str:
+    return Path(module).as_posix().strip('/')
+
+
+def prepare_checkout(repo: Repo, module: str, history: bool, full: bool = False):
+    """Make an existing clone cover what the run needs: the history if it is shallow, and the module
+    if it is a sparse checkout of other modules
+
+    Args:
+        repo (Repo): the existing clone
+        module (str): path of the module tests are generated for, None for the whole repository
+        history (bool): the commit history is needed
+        full (bool): the whole history and every directory are needed, like in a plain git clone
+    """
+    if os.path.isfile(os.path.join(repo.git_dir, 'shallow')):
+        if full:
+            logging.info('Fetching the full history of the shallow clone')
+            repo.git.fetch('--unshallow', 'origin')
+        elif history:
+            logging.info('Fetching the history of the shallow clone')
+            repo.git.fetch('--unshallow', '--filter=blob:none', 'origin')
+    if is_sparse(repo):
+        if module and not full:
+            repo.git.sparse_checkout('add', sparse_path(module))
+        else:
+            logging.info('Checking out every directory of the sparse clone')
+            repo.git.sparse_checkout('disable')
+
+
+def is_sparse(repo: Repo) -> bool:
+    # Sparse checkouts keep their settings in the worktree config, which only git itself reads
+    try:
+        return repo.git.config('--get', 'core.sparseCheckout') == 'true'
+    except GitCommandError:
+        return False
+
+
 def check_if_cloned(repo_url: str, repo_path: str) -> Path:
     """Checks if the repository is cloned locally, and returns a relative path to it
 
@@ -75,3 +287,93 @@ def check_if_git_repo(repo_path: str):
     if not os.path.isdir(os.path.join(repo_path, '.git')):
         logging.error(f"Error: {repo_path} is not a Git repository")
         exit(1)
+
+
+def find_changed_files(repo_path: Path, since: str) -> set[str]:
+    """Find the java files that changed since a commit, including uncommitted and untracked changes
+
+    Args:
+        repo_path (Path): path to local repository
+        since (str): commit to compare against
+
+    Returns:
+        set[str]: absolute paths of the changed main java files that still exist
+    """
+    repo = Repo(repo_path)
+    # The base may be missing from the clone, like a commit that was force pushed away
+    try:
+        commit = repo.commit(since)
+        diffs = commit.diff(None)
+    except Exception as e:
+        logging.error(
+            f"Error: could not find the changes since {since} in {repo_path}: {e}")
+        exit(1)
+
+    changed = set()
+    for diff in diffs:
+        if diff.deleted_file or not is_main_source(diff.b_path):
+            continue
+        changed.add(str(Path(repo_path).joinpath(diff.b_path).absolute()))
+    # The tests written into the clone are untracked, only main sources count so they don't show up as changes
+    for untracked in repo.untracked_files:
+        if is_main_source(untracked):
+            changed.add(str(Path(repo_path).joinpath(untracked).absolute()))
+    logging.info(
+        f'Found {len(changed)} changed java file(s) in {repo_path} since {commit.hexsha[:10]}')
+    return changed
+
+
+def is_main_source(path: str) -> bool:
+    """Whether a path in the repository is a java file tests are generated for, one in the main directory of a
+    src directory like preprocess.find_files looks in
+
+    Args:
+        path (str): path relative to the repository root
+
+    Returns:
+        bool: True for main java sources
+    """
+    parts = Path(path).parts
+    return path.endswith('.java') and any('src' in part and following == 'main'
+                                          for part, following in zip(parts, parts[1:]))
+
+
+def generated_commit_key(repo_path: Path, module: str = None) -> str:
+    # Modules of a repository are generated separately, each of them has its own last commit
+    if not module:
+        return str(repo_path)
+    return f'{repo_path}:{Path(module).as_posix().strip("/")}'
+
+
+def last_generated_commit(repo_path: Path, module: str = None) -> str:
+    """Commit the tests were last generated for
+
+    Args:
+        repo_path (Path): path to local repository
+        module (str): module the tests were generated for, None for the whole repository
+
+    Returns:
+        str: commit sha, None if tests were never generated for this repository and module
+    """
+    if not os.path.isfile(LAST_COMMITS_FILE):
+        return None
+    with open(LAST_COMMITS_FILE, 'r') as file:
+        return json.load(file).get(generated_commit_key(repo_path, module))
+
+
+def record_generated_commit(repo_path: Path, module: str = None):
+    """Remember the current HEAD so the next --changed-only run starts from it
+
+    Args:
+        repo_path (Path): path to local repository
+        module (str): module the tests were generated for, None for the whole repository
+    """
+    commit = Repo(repo_path).head.commit.hexsha
+    with _commits_lock:
+        commits = {}
+        if os.path.isfile(LAST_COMMITS_FILE):
+            with open(LAST_COMMITS_FILE, 'r') as file:
+                commits = json.load(file)
+        commits[generated_commit_key(repo_path, module)] = commit
+        with open(LAST_COMMITS_FILE, 'w') as file:
+            json.dump(commits, file, indent=4)
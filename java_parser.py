@@ -0,0 +1,370 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import re
+from method import Method
+from method_signature import MethodSignature
+
+# Bump whenever the shape of the parsed output changes, cached parses are dropped with it
+PARSER_VERSION = 1
+
+TOKEN_PATTERN = re.compile(
+    # Whitespace is matched so it can be skipped
+    r'(?P<whitespace>\s+)'
+    # Block comments (possibly unterminated) and line comments
+    r'|(?P<comment>/\*(?:.*?\*/|.*)|//[^\n]*)'
+    # Text blocks, string and char literals
+    r'|(?P<string>"""(?:.*?""")?|"(?:[^"\\\n]|\\.)*"?|\'(?:[^\'\\\n]|\\.)*\'?)'
+    # Identifiers, keywords and numbers
+    r'|(?P<word>[A-Za-z_$][\w$]*|\d[\w.]*)'
+    # Everything else is a single character symbol, except varargs
+    r'|(?P<symbol>\.\.\.|.)',
+    re.DOTALL)
+
+ACCESS_MODIFIERS = ('public', 'protected', 'private')
+MODIFIERS = ('static', 'final', 'abstract', 'synchronized', 'native', 'default',
+             'strictfp', 'transient', 'volatile', 'sealed', 'non-sealed')
+TYPE_KEYWORDS = ('class', 'interface', 'enum', 'record')
+
+
+def tokenize(code: str) -> list[tuple]:
+    """Splits java source into tokens, skipping whitespace. Braces inside comments and literals never become symbols
+
+    Args:
+        code (str): the full text of a java code document
+
+    Returns:
+        list[tuple]: (kind, text, start, end) for every token
+    """
+    return [(match.lastgroup, match.group(), match.start(), match.end())
+            for match in TOKEN_PATTERN.finditer(code) if match.lastgroup != 'whitespace']
+
+
+def parse_java(code: str) -> dict:
+    """Parses a java file in a single pass over its tokens
+
+    Args:
+        code (str): the full text of a java code document
+
+    Returns:
+        dict: package, imports, class_signatures, class_comments, fields and methods of the file
+    """
+    return _Parser(code).parse()
+
+
+class _Parser:
+    def __init__(self, code: str) -> None:
+        self.code = code
+        self.tokens = tokenize(code)
+        self.newlines = [match.start() for match in re.finditer('\n', code)]
+        self.pos = 0
+        self.package = ''
+        self.imports = []
+        self.class_signatures = []
+        self.class_comments = []
+        self.fields = []
+        self.methods = []
+
+    def parse(self) -> dict:
+        while self.pos < len(self.tokens):
+            if self.tokens[self.pos][1] == '}':
+                # Unbalanced closing brace at the top level
+                self.pos += 1
+                continue
+            self.parse_declaration(None)
+        return {'package': self.package,
+                'imports': self.imports,
+                'class_signatures': self.class_signatures,
+                'class_comments': self.class_comments,
+                'fields': self.fields,
+                'methods': self.methods}
+
+    def text(self, start: int, end: int) -> str:
+        """Source between two offsets with the whitespace collapsed"""
+        return ' '.join(self.code[start:end].split())
+
+    def line(self, offset: int) -> int:
+        return bisect.bisect_right(self.newlines, offset - 1) + 1
+
+    def skip_balanced(self, index: int) -> int:
+        """Returns the index of the token closing the bracket opened at index, or the last token"""
+        opening = self.tokens[index][1]
+        closing = {'{': '}', '(': ')', '[': ']'}[opening]
+        depth = 0
+        for i in range(index, len(self.tokens)):
+            kind, text, _, _ = self.tokens[i]
+            if kind != 'symbol':
+                continue
+            if text == opening:
+                depth += 1
+            elif text == closing:
+                depth -= 1
+                if depth == 0:
+                    return i
+        return len(self.tokens) - 1
+
+    def skip_annotation(self):
+        """Moves past an annotation such as @Override or @SuppressWarnings("unchecked")"""
+        self.pos += 2
+        while self.pos + 1 < len(self.tokens) and self.tokens[self.pos][1] == '.':
+            self.pos += 2
+        if self.pos < len(self.tokens) and self.tokens[self.pos][1] == '(':
+            self.pos = self.skip_balanced(self.pos) + 1
+
+    def parse_declaration(self, parent: dict):
+        """Parses one declaration in the body of parent (or at the top level of the file if None)"""
+        comment = ''
+        header = []
+        paren_depth = 0
+        start = None
+        while self.pos < len(self.tokens):
+            kind, text, token_start, _ = self.tokens[self.pos]
+            if kind == 'comment':
+                if not header and text.startswith('/*'):
+                    comment = text
+                    if parent is None and text.startswith('/**') and not self.class_signatures:
+                        self.class_comments.append(text)
+                self.pos += 1
+                continue
+            if start is None:
+                start = token_start
+            if text == '@' and kind == 'symbol' and not self.next_is('interface'):
+                self.skip_annotation()
+                continue
+            if text == '}' and kind == 'symbol' and paren_depth == 0:
+                # End of the parent body, left for the caller
+                return
+            if kind == 'symbol' and paren_depth == 0 and text in ('{', ';', '='):
+                break
+            if text == '(':
+                paren_depth += 1
+            elif text == ')':
+                paren_depth -= 1
+            header.append(self.tokens[self.pos])
+            self.pos += 1
+
+        if self.pos >= len(self.tokens):
+            return
+        end_token = self.tokens[self.pos]
+        words = [token[1] for token in header]
+
+        type_index = self.type_keyword_index(header)
+        if type_index is not None and end_token[1] == '{':
+            self.parse_type(header, type_index, start, parent)
+            return
+
+        name_index = self.method_name_index(header)
+        if name_index is not None and end_token[1] in ('{', ';'):
+            self.parse_method(header, name_index, start, comment, parent)
+            return
+
+        if end_token[1] == '{':
+            # Initializer blocks and anything unrecognized are skipped whole
+            self.pos = self.skip_balanced(self.pos) + 1
+            return
+
+        if end_token[1] == '=':
+            self.skip_initializer()
+        end = self.tokens[min(self.pos, len(self.tokens) - 1)][3]
+        self.pos += 1
+        if not words:
+            return
+        if parent is None:
+            if words[0] == 'package':
+                self.package = self.code[start:end]
+            elif words[0] == 'import':
+                self.imports.append(self.code[start:end])
+        else:
+            self.fields.append(self.text(start, end))
+
+    def next_is(self, word: str) -> bool:
+        return self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1][1] == word
+
+    def skip_initializer(self):
+        """Moves to the semicolon ending a field initializer, skipping array initializers and anonymous classes"""
+        while self.pos < len(self.tokens):
+            kind, text, _, _ = self.tokens[self.pos]
+            if kind == 'symbol':
+                if text in ('{', '(', '['):
+                    self.pos = self.skip_balanced(self.pos)
+                elif text == ';':
+                    return
+            self.pos += 1
+
+    def type_keyword_index(self, header: list[tuple]) -> int:
+        for i, (kind, text, _, _) in enumerate(header):
+            if kind != 'word' or text not in TYPE_KEYWORDS:
+                continue
+            if i > 0 and header[i - 1][1] == '.':
+                continue
+            if text == 'record' and (i + 1 >= len(header) or header[i + 1][0] != 'word'):
+                continue
+            return i
+        return None
+
+    def method_name_index(self, header: list[tuple]) -> int:
+        for i, (kind, text, _, _) in enumerate(header):
+            if text == '(' and kind == 'symbol':
+                if i > 0 and header[i - 1][0] == 'word':
+                    return i - 1
+                return None
+        return None
+
+    def parse_type(self, header: list[tuple], type_index: int, start: int, parent: dict):
+        typ = header[type_index][1]
+        if typ == 'record':
+            typ = 'class'
+        signature_start = header[0][2]
+        info = {'signature': self.text(signature_start, self.tokens[self.pos][3]),
+                'type': typ}
+        if type_index + 1 < len(header):
+            info['name'] = header[type_index + 1][1]
+        for clause in ('extends', 'implements'):
+            types = self.clause_types(header, clause)
+            if types:
+                info[clause] = types
+        self.class_signatures.append(info)
+
+        self.pos += 1
+        if typ == 'enum':
+            self.parse_enum_constants()
+        while self.pos < len(self.tokens) and self.tokens[self.pos][1] != '}':
+            self.parse_declaration(info)
+        self.pos += 1
+
+    def clause_types(self, header: list[tuple], clause: str) -> list[str]:
+        """Types listed after extends/implements/throws, split on top level commas"""
+        clause_index = None
+        depth = 0
+        for i, (kind, text, _, _) in enumerate(header):
+            if text == '<':
+                depth += 1
+            elif text == '>':
+                depth -= 1
+            elif depth == 0 and kind == 'word' and text == clause:
+                clause_index = i
+                break
+        if clause_index is None:
+            return []
+        types = []
+        current = None
+        for kind, text, token_start, token_end in header[clause_index + 1:]:
+            if depth == 0 and kind == 'word' and text in ('extends', 'implements', 'permits', 'default'):
+                break
+            if text == '<':
+                depth += 1
+            elif text == '>':
+                depth -= 1
+            if depth == 0 and text == ',':
+                # An empty entry, like the one in implements A,,B, has no type to keep
+                if current:
+                    types.append(current)
+                current = None
+                continue
+            current = (current[0] if current else token_start, token_end)
+        if current:
+            types.append(current)
+        return [self.text(type_start, type_end) for type_start, type_end in types]
+
+    def parse_enum_constants(self):
+        while self.pos < len(self.tokens):
+            kind, text, _, _ = self.tokens[self.pos]
+            if text == '}' and kind == 'symbol':
+                return
+            if text == ';' and kind == 'symbol':
+                self.pos += 1
+                return
+            if text == '@' and kind == 'symbol':
+                self.skip_annotation()
+                continue
+            if kind == 'symbol' and text in ('(', '{'):
+                self.pos = self.skip_balanced(self.pos)
+            elif kind == 'word':
+                self.fields.append(text)
+            self.pos += 1
+
+    def parse_method(self, header: list[tuple], name_index: int, start: int, comment: str, parent: dict):
+        name = header[name_index][1]
+        access = ''
+        modifiers = []
+        type_start = 0
+        for i, (kind, text, _, _) in enumerate(header[:name_index]):
+            if text in ACCESS_MODIFIERS:
+                access = text
+            elif text in MODIFIERS:
+                modifiers.append(text)
+            else:
+                type_start = i
+                break
+        else:
+            type_start = name_index
+        if type_start < name_index and header[type_start][1] == '<':
+            # Generic method type parameters come before the return type
+            depth = 0
+            for i in range(type_start, name_index):
+                if header[i][1] == '<':
+                    depth += 1
+                elif header[i][1] == '>':
+                    depth -= 1
+                    if depth == 0:
+                        type_start = i + 1
+                        break
+        ret_val = ''
+        if type_start < name_index:
+            ret_val = self.text(header[type_start][2], header[name_index - 1][3])
+
+        close_index = name_index + 1
+        depth = 0
+        parameters = []
+        param_start = None
+        for i in range(name_index + 1, len(header)):
+            kind, text, token_start, token_end = header[i]
+            if text in ('(', '<'):
+                depth += 1
+                if depth == 1:
+                    continue
+            elif text in (')', '>'):
+                depth -= 1
+                if depth == 0:
+                    close_index = i
+                    if param_start is not None:
+                        parameters.append(self.text(param_start, header[i - 1][3]))
+                    break
+            if depth == 1 and text == ',':
+                parameters.append(self.text(param_start, header[i - 1][3]))
+                param_start = None
+                continue
+            if param_start is None:
+                param_start = token_start
+
+        exceptions = self.clause_types(header[close_index:], 'throws')
+
+        end_token = self.tokens[self.pos]
+        body = ''
+        if end_token[1] == '{':
+            close = self.skip_balanced(self.pos)
+            body = self.code[end_token[2]:self.tokens[close][3]]
+            self.pos = close
+        elif parent is None or parent['type'] != 'interface':
+            # Abstract and native methods are only kept for interfaces
+            self.pos += 1
+            return
+        end = self.tokens[self.pos][3]
+        self.pos += 1
+
+        is_constructor = not ret_val and parent is not None and name == parent.get('name')
+        signature = MethodSignature(access, modifiers, ret_val, name, parameters, exceptions)
+        self.methods.append(Method(signature, body, comment, parent, is_constructor,
+                                   start=start, end=end, start_line=self.line(start), end_line=self.line(end - 1)))
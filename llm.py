@@ -12,9 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from vertexai.preview.language_models import ChatModel
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
+import threading
 from pathlib import Path
+from typing import Iterable, Iterator
+from response_cache import ResponseCache
+from llm_client import LLMClient
+from llm_backends import VertexBackend, RecordingBackend
+from context_budget import estimate_tokens
+from prompt_packing import split_response
+from test_merger import merge_tests
+import tracing
 import logging
 from logging_config import configure_logging
 configure_logging()
@@ -30,57 +40,208 @@ parameters = {
     "top_k": 15,
 }
 
-chat_model = ChatModel.from_pretrained("chat-bison@001")
+MODEL_NAME = "chat-bison@001"
 
+backend = None
+_backend_lock = threading.Lock()
 
-def generate_tests(prompts: dict) -> dict:
+
+def use_backend(new_backend):
+    """Set the backend requests are sent to, see llm_backends
+
+    Args:
+        new_backend: backend with start_chat(context)
+    """
+    global backend
+    backend = new_backend
+
+
+def get_backend():
+    """Backend requests are sent to, Vertex AI unless another one was set
+
+    Returns:
+        backend with start_chat(context)
+    """
+    global backend
+    with _backend_lock:
+        if backend is None:
+            backend = VertexBackend(MODEL_NAME)
+    return backend
+
+
+def generate_tests(prompts: dict, concurrency: int = 1, cache: ResponseCache = None, client: LLMClient = None, llm_combine: bool = False) -> dict:
     """Generate the tests using the LLM
 
     Args:
         prompts (dict): All of the prompts we have created in previous steps
+        concurrency (int): Maximum number of requests in flight to the LLM at once
+        cache (ResponseCache): Previously received responses, None to always ask the LLM
+        client (LLMClient): rate limits and retries the requests, None for the default limits
+        llm_combine (bool): ask the LLM to combine the tests of a file instead of merging them locally
 
     Returns:
         dict: key: path value: test file contents
     """
+    return dict(iter_tests(prompts.items(), concurrency, cache, client, llm_combine))
 
-    final_results = {}
-    for path, prompt_list in prompts.items():
-        results = []
-        name = f'{Path(path).stem}GenTest'
-        name = name.replace('.', '_')
-        logging.info(
-            f'Starting to generate test(s) for {str(Path(path).relative_to(Path("./target_repository/").absolute()))}')
-        for prompt in prompt_list:
-
-            context = json.loads(prompt['context'])
-            chat = chat_model.start_chat(
-                context=json.dumps(context)
-            )
-            response = ''
-            try:
-                response = chat.send_message(
-                    prompt['question'], **parameters)
-            except Exception as e:
-                logging.warning(f'Error when connecting to the LLM: {e}')
-                continue
 
-            results.append(response.text)
+def iter_tests(prompts: Iterable[tuple[str, list[dict]]], concurrency: int = 1, cache: ResponseCache = None, client: LLMClient = None, llm_combine: bool = False) -> Iterator[tuple[Path, str]]:
+    """Generate the tests using the LLM, as a stream
+
+    Prompts are dispatched to a thread pool as they arrive, and the responses are gathered back
+    per source file in the original order, so the output stays deterministic regardless of
+    which request finishes first. Only a few times `concurrency` prompts are in flight at once,
+    so a slow LLM holds back the earlier stages instead of buffering the whole repository.
+
+    Args:
+        prompts (Iterable[tuple[str, list[dict]]]): source file paths and their prompts, may be a stream
+        concurrency (int): Maximum number of requests in flight to the LLM at once
+        cache (ResponseCache): Previously received responses, None to always ask the LLM
+        client (LLMClient): rate limits and retries the requests, None for the default limits
+        llm_combine (bool): ask the LLM to combine the tests of a file instead of merging them locally
+
+    Yields:
+        tuple[Path, str]: path of the test file, and its contents
+    """
+    if client is None:
+        client = LLMClient()
+    concurrency = max(1, concurrency)
+    window = concurrency * 4
+    generated = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='llm') as executor:
+        requesting = deque()
+        combining = deque()
+        in_flight = 0
+        for path, prompt_list in prompts:
+            relative_path = str(Path(path).relative_to(
+                Path("./target_repository/").absolute()))
+            logging.info(
+                f'Starting to generate test(s) for {relative_path}')
+            futures = [executor.submit(send_prompt, prompt, cache, client, f'{relative_path}#{i}')
+                       for i, prompt in enumerate(prompt_list)]
+            requesting.append((path, futures))
+            in_flight += len(futures)
+
+            while in_flight > window:
+                path, futures = requesting.popleft()
+                in_flight -= len(futures)
+                combining.append(start_combining(
+                    executor, path, futures, cache, client, llm_combine))
+            while combining and combining[0].done():
+                for test_path, content in combining.popleft().result().items():
+                    generated += 1
+                    yield test_path, content
+
+        while requesting:
+            combining.append(start_combining(
+                executor, *requesting.popleft(), cache, client, llm_combine))
+        while combining:
+            for test_path, content in combining.popleft().result().items():
+                generated += 1
+                yield test_path, content
+    if cache:
         logging.info(
-            f'Finished generating test(s) for {str(Path(path).relative_to(Path("./target_repository/").absolute()))}')
-        prepare_final_results(name, path, results, final_results)
-    return final_results
+            f'Generated tests for {generated} file(s), {cache.stats()}')
+
+
+def start_combining(executor: ThreadPoolExecutor, path: str, futures: list[Future], cache: ResponseCache = None, client: LLMClient = None, llm_combine: bool = False) -> Future:
+    """Wait for the responses of a file, then submit combining them into 1 test file
+
+    Args:
+        executor (ThreadPoolExecutor): pool the LLM requests run on
+        path (str): path of the source file
+        futures (list[Future]): pending responses for the file
+        cache (ResponseCache): Previously received responses
+        client (LLMClient): rate limits and retries the requests
+        llm_combine (bool): ask the LLM to combine the tests instead of merging them locally
 
+    Returns:
+        Future: resolves to the final results of the file
+    """
+    results = [test for future in futures for test in future.result()]
+    logging.info(
+        f'Finished generating test(s) for {str(Path(path).relative_to(Path("./target_repository/").absolute()))}')
+    name = f'{Path(path).stem}GenTest'
+    name = name.replace('.', '_')
+    return executor.submit(prepare_final_results, name, path, results, {}, cache, client, llm_combine)
+
+
+def send_prompt(prompt: dict, cache: ResponseCache = None, client: LLMClient = None, label: str = '') -> list[str]:
+    """Send a single prompt to the LLM
+
+    Args:
+        prompt (dict): prompt with its 'context' dict and 'question', and the number of 'methods' if it is packed
+        cache (ResponseCache): Previously received responses
+        client (LLMClient): rate limits and retries the request
+        label (str): what the prompt is for, used in the failure report
+
+    Returns:
+        list[str]: the tests of every method of the prompt, empty if the LLM could not be reached
+    """
+    context = json.dumps(prompt['context'])
+    with tracing.span('send_message', 'llm', prompt=label,
+                      prompt_tokens=estimate_tokens(context) + estimate_tokens(prompt['question'])) as trace_span:
+        try:
+            text = ask(context, prompt['question'], cache, client, label)
+        except Exception as e:
+            logging.warning(f'Error when connecting to the LLM: {e}')
+            return []
+        trace_span.set(response_tokens=estimate_tokens(text))
+        return split_response(text, prompt.get('methods', 1))
+
+
+def ask(context: str, question: str, cache: ResponseCache = None, client: LLMClient = None, label: str = '') -> str:
+    """Start a chat with the given context and send it the question, going through the cache if there is one
+
+    Args:
+        context (str): context of the chat
+        question (str): message to send
+        cache (ResponseCache): Previously received responses
+        client (LLMClient): rate limits and retries the request, None to send it once right away
+        label (str): what the request is for, used in the failure report
+
+    Returns:
+        str: text of the response
+    """
+    chat_backend = get_backend()
+    if cache:
+        text = cache.get(context, question,
+                         chat_backend.model_name, parameters)
+        if text is not None:
+            tracing.annotate(cached=True)
+            # A recording has to answer every request of the run when it is replayed, cached ones included
+            if isinstance(chat_backend, RecordingBackend):
+                chat_backend.record(context, question, parameters, text)
+            return text
+
+    def send() -> str:
+        chat = chat_backend.start_chat(
+            context=context
+        )
+        return chat.send_message(question, **parameters).text
+
+    if client:
+        tokens = estimate_tokens(context) + estimate_tokens(question) + \
+            parameters['max_output_tokens']
+        text = client.call(send, tokens, label)
+    else:
+        text = send()
+    if cache:
+        cache.put(context, question, chat_backend.model_name, parameters, text)
+    return text
 
-def prepare_final_results(name: str, path: str, results: list[str], final_results: dict) -> dict:
-    """Combine results into one file, and make the path the correct place
+
+def prepare_final_results(name: str, path: str, results: list[str], final_results: dict, cache: ResponseCache = None, client: LLMClient = None, llm_combine: bool = False) -> dict:
+    """Combine results into one file, and make the path the correct place. If the LLM cannot combine the tests,
+    they are merged locally instead
 
     Args:
         name (str): name of the test
         results (list[str]): results from the LLM
         final_results (dict): collection of all the results
-
-    Raises:
-        e: Exception from the LLM when combining the tests
+        cache (ResponseCache): Previously received responses
+        client (LLMClient): rate limits and retries the requests
+        llm_combine (bool): ask the LLM to combine the tests instead of merging them locally
 
     Returns:
         dict: all the results
@@ -96,11 +257,17 @@ def prepare_final_results(name: str, path: str, results: list[str], final_result
         logging.info(
             f'Multiple tests found for {str(Path(test_path).relative_to(Path("./target_repository/").absolute()))}, combining into 1 test file')
 
-        try:
-            res = combine_tests(results)
-        except Exception as e:
-            logging.error(f'Failed combining tests: {e}')
-            raise e
+        res = None
+        if llm_combine:
+            try:
+                res = combine_tests(results, cache, client,
+                                    f'{Path(test_path).relative_to(Path("./target_repository/").absolute())}#combine')
+            except Exception as e:
+                logging.error(
+                    f'Failed combining tests, merging them locally for {name}: {e}')
+        if res is None:
+            with tracing.span('merge_tests', tests=len(results), test=name):
+                res = merge_tests(results, name)
 
         final_results[test_path] = res
     elif results:
@@ -110,17 +277,20 @@ def prepare_final_results(name: str, path: str, results: list[str], final_result
     return final_results
 
 
-def combine_tests(results: list[str]) -> str:
+def combine_tests(results: list[str], cache: ResponseCache = None, client: LLMClient = None, label: str = '') -> str:
     """Combine relavant tests
 
     Args:
         results (list[str]): Tests to combine
+        cache (ResponseCache): Previously received responses
+        client (LLMClient): rate limits and retries the request
+        label (str): what the request is for, used in the failure report
 
     Returns:
         str: combined tests
     """
-    chat = chat_model.start_chat(
-        context=", ".join(results)
-    )
-    return chat.send_message(
-        f'Combine the following tests into one java test file. Add in any imports for core java code lists, queues, maps, etc that are missing', **parameters).text
+    with tracing.span('combine_tests', 'llm', tests=len(results)) as trace_span:
+        text = ask(", ".join(results),
+                   f'Combine the following tests into one java test file. Add in any imports for core java code lists, queues, maps, etc that are missing', cache, client, label)
+        trace_span.set(response_tokens=estimate_tokens(text))
+        return text
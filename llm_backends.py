@@ -0,0 +1,223 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import random
+import re
+import threading
+import time
+from response_cache import cache_key
+from context_budget import find_parent
+from prompt_packing import PACKED_KEY, MARKER
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+BACKENDS = ('vertex', 'local', 'record', 'replay')
+RECORDING_FILE = 'llm_recording.jsonl'
+DEFAULT_LOCAL_LATENCY = 0.5
+
+LOCAL_TEST_TEMPLATE = '''Here are the tests:
+```java
+{package}
+
+import org.junit.jupiter.api.Test;
+import static org.junit.jupiter.api.Assertions.*;
+
+public class {test_name} {{
+    @Test
+    void {method_name}Runs() {{
+        assertNotNull("{method_name}");
+    }}
+}}
+```'''
+
+# A backend has start_chat(context) returning a chat with send_message(question, **parameters),
+# whose response has the generated .text, the same as the Vertex AI ChatModel
+
+
+class Response:
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+
+class VertexBackend:
+    def __init__(self, model_name: str) -> None:
+        """Vertex AI chat model, only imported when it is used so the other backends work without it
+
+        Args:
+            model_name (str): name of the chat model
+        """
+        from vertexai.preview.language_models import ChatModel
+        self.model_name = model_name
+        self.chat_model = ChatModel.from_pretrained(model_name)
+
+    def start_chat(self, context: str):
+        return self.chat_model.start_chat(context=context)
+
+
+class LocalChat:
+    def __init__(self, backend, context: str) -> None:
+        self.backend = backend
+        self.context = context
+
+    def send_message(self, question: str, **parameters) -> Response:
+        self.backend.wait()
+        try:
+            context = json.loads(self.context)
+        except ValueError:
+            context = None
+        if not isinstance(context, dict):
+            # Combining tests, the context holds the tests to combine
+            blocks = re.findall(r'```java.*?```', self.context, re.DOTALL)
+            return Response(blocks[0] if blocks else self.context)
+        packed = find_parent(context, PACKED_KEY)
+        targets = packed[PACKED_KEY] if packed else [
+            find_parent(context, 'target_method_signature') or {}]
+        package = context.get('package', '')
+        if package and not package.startswith('package'):
+            package = f'package {package};'
+        tests = []
+        for i, target in enumerate(targets):
+            try:
+                method_name = json.loads(
+                    target.get('target_method_signature', '{}'))['name']
+            except (ValueError, KeyError, TypeError):
+                method_name = 'method'
+            test = LOCAL_TEST_TEMPLATE.format(package=package,
+                                              test_name=context.get(
+                                                  'test_name', 'GeneratedTest').replace('-', ''),
+                                              method_name=method_name)
+            if packed:
+                test = test.replace(
+                    '```java\n', f'```java\n{MARKER.format(i + 1)}\n')
+            tests.append(test)
+        return Response('\n'.join(tests))
+
+
+class LocalBackend:
+    def __init__(self, latency: float = DEFAULT_LOCAL_LATENCY, jitter: float = 0.2) -> None:
+        """Offline stand-in for the LLM, answers every prompt with a templated test for its method
+
+        Args:
+            latency (float): average seconds a response takes
+            jitter (float): fraction the latency randomly varies by
+        """
+        self.model_name = 'local'
+        self.latency = latency
+        self.jitter = jitter
+
+    def wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency * random.uniform(1 -
+                       self.jitter, 1 + self.jitter))
+
+    def start_chat(self, context: str) -> LocalChat:
+        return LocalChat(self, context)
+
+
+class RecordingChat:
+    def __init__(self, backend, context: str) -> None:
+        self.backend = backend
+        self.context = context
+        self.chat = backend.inner.start_chat(context)
+
+    def send_message(self, question: str, **parameters) -> Response:
+        response = self.chat.send_message(question, **parameters)
+        self.backend.record(self.context, question, parameters, response.text)
+        return response
+
+
+class RecordingBackend:
+    def __init__(self, inner, path: str = RECORDING_FILE) -> None:
+        """Passes every request on to another backend, and appends the exchanges to a jsonl file for replay
+
+        Args:
+            inner: backend that answers the requests
+            path (str): file the exchanges are appended to
+        """
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.path = path
+        self.lock = threading.Lock()
+
+    def start_chat(self, context: str) -> RecordingChat:
+        return RecordingChat(self, context)
+
+    def record(self, context: str, question: str, parameters: dict, text: str):
+        entry = {'key': cache_key(context, question, self.model_name, parameters),
+                 'text': text}
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(entry))
+                file.write('\n')
+
+
+class ReplayChat:
+    def __init__(self, backend, context: str) -> None:
+        self.backend = backend
+        self.context = context
+
+    def send_message(self, question: str, **parameters) -> Response:
+        key = cache_key(self.context, question,
+                        self.backend.model_name, parameters)
+        if key not in self.backend.responses:
+            raise KeyError(f'No recorded response for request {key}')
+        return Response(self.backend.responses[key])
+
+
+class ReplayBackend:
+    def __init__(self, model_name: str, path: str = RECORDING_FILE) -> None:
+        """Answers requests with the responses recorded by RecordingBackend, without any network access.
+        Requests that were not recorded fail
+
+        Args:
+            model_name (str): name of the model the responses were recorded from
+            path (str): jsonl file of recorded exchanges
+        """
+        self.model_name = model_name
+        self.responses = {}
+        with open(path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.responses[entry['key']] = entry['text']
+        logging.info(
+            f'Loaded {len(self.responses)} recorded responses from {path}')
+
+    def start_chat(self, context: str) -> ReplayChat:
+        return ReplayChat(self, context)
+
+
+def create_backend(name: str, model_name: str, recording: str = RECORDING_FILE, latency: float = DEFAULT_LOCAL_LATENCY):
+    """Create the backend the LLM requests are sent to
+
+    Args:
+        name (str): one of BACKENDS
+        model_name (str): name of the Vertex AI chat model
+        recording (str): file the record backend writes to and the replay backend reads from
+        latency (float): average response time of the local backend, in seconds
+
+    Returns:
+        backend with start_chat(context)
+    """
+    if name == 'vertex':
+        return VertexBackend(model_name)
+    if name == 'local':
+        return LocalBackend(latency)
+    if name == 'record':
+        return RecordingBackend(VertexBackend(model_name), recording)
+    if name == 'replay':
+        return ReplayBackend(model_name, recording)
+    raise ValueError(f'Unknown LLM backend {name}')
@@ -0,0 +1,211 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+from contextlib import nullcontext
+import json
+import os
+import random
+import threading
+import time
+from typing import Callable
+from google.api_core import exceptions
+import tracing
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+# Default request quota of the Vertex AI chat models
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_MAX_RETRIES = 5
+BASE_DELAY = 1
+MAX_DELAY = 60
+FAILURE_REPORT = 'failed_prompts.json'
+
+RETRYABLE_ERRORS = (exceptions.TooManyRequests, exceptions.ResourceExhausted, exceptions.ServiceUnavailable,
+                    exceptions.DeadlineExceeded, exceptions.InternalServerError, exceptions.Aborted,
+                    ConnectionError, TimeoutError)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        """Allows per_minute units a minute, refilled continuously, with bursts of up to a minute's worth
+
+        Args:
+            per_minute (float): units allowed every minute
+        """
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        """Block until amount units are available, then take them
+
+        Args:
+            amount (float): units to take, capped at the capacity of the bucket
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    def __init__(self, window: int = 20, threshold: float = 0.5, min_calls: int = 10, cooldown: float = 30) -> None:
+        """Pauses every request for a while once too many of the recent ones failed
+
+        Args:
+            window (int): how many of the latest requests the error rate is computed over
+            threshold (float): error rate that opens the circuit
+            min_calls (int): requests needed in the window before the circuit can open
+            cooldown (float): seconds the circuit stays open
+        """
+        self.outcomes = deque(maxlen=window)
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block while the circuit is open"""
+        while True:
+            with self.lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record(self, success: bool):
+        with self.lock:
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.threshold:
+                logging.warning(
+                    f'{failures} of the last {len(self.outcomes)} LLM requests failed, pausing requests for {self.cooldown}s')
+                self.open_until = time.monotonic() + self.cooldown
+                # Start over once the circuit closes again
+                self.outcomes.clear()
+
+
+class LLMClient:
+    def __init__(self, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute: float = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES, breaker: CircuitBreaker = None, max_in_flight: int = None) -> None:
+        """Sends requests to the LLM within its quota, retrying the ones that fail for temporary reasons
+
+        Args:
+            requests_per_minute (float): request quota, None for no limit
+            tokens_per_minute (float): token quota, None for no limit
+            max_retries (int): retries of a request before it is given up on
+            breaker (CircuitBreaker): pauses requests when the error rate spikes, None for the default one
+            max_in_flight (int): requests sent at once by everything sharing the client, None for no limit
+        """
+        self.requests = TokenBucket(
+            requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(
+            tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = threading.BoundedSemaphore(
+            max_in_flight) if max_in_flight else None
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def call(self, send: Callable[[], str], tokens: int, label: str) -> str:
+        """Send a request
+
+        Args:
+            send (Callable[[], str]): makes the request and returns the text of the response
+            tokens (int): estimated tokens the request uses
+            label (str): what the request is for, used in the failure report
+
+        Raises:
+            Exception: the last error, once the request permanently failed
+
+        Returns:
+            str: text of the response
+        """
+        attempt = 0
+        while True:
+            self.breaker.wait()
+            if self.requests:
+                self.requests.acquire()
+            if self.tokens:
+                self.tokens.acquire(tokens)
+            try:
+                with self.in_flight or nullcontext(), tracing.span('request', 'llm', attempt=attempt):
+                    text = send()
+            except Exception as e:
+                self.breaker.record(False)
+                if not isinstance(e, RETRYABLE_ERRORS) or attempt >= self.max_retries:
+                    self.record_failure(label, e, attempt + 1)
+                    tracing.annotate(retries=attempt)
+                    raise
+                # Full jitter, so throttled workers do not retry in lockstep
+                delay = random.uniform(
+                    0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+                attempt += 1
+                logging.info(
+                    f'Retrying {label} in {delay:.1f}s ({attempt}/{self.max_retries}) after: {e}')
+                time.sleep(delay)
+                continue
+            self.breaker.record(True)
+            tracing.annotate(retries=attempt)
+            return text
+
+    def record_failure(self, label: str, error: Exception, attempts: int):
+        with self.lock:
+            self.failures.append({'prompt': label,
+                                  'error': type(error).__name__,
+                                  'message': str(error),
+                                  'attempts': attempts})
+
+    def failures_for(self, directory: str) -> list[dict]:
+        """Requests that permanently failed for the files in a directory
+
+        Args:
+            directory (str): directory relative to the target repository directory, like the request labels
+
+        Returns:
+            list[dict]: the failures, in the order they happened
+        """
+        prefix = directory.rstrip('/') + '/'
+        with self.lock:
+            return [failure for failure in self.failures if failure['prompt'].startswith(prefix)]
+
+    def write_failure_report(self, path: str = FAILURE_REPORT):
+        """Write the requests that permanently failed to a json file. If there were none, the report of an earlier run
+        is removed so it is not mistaken for this one
+
+        Args:
+            path (str): file to write the report to
+        """
+        if not self.failures:
+            if os.path.isfile(path):
+                os.remove(path)
+            return
+        with open(path, 'w') as file:
+            json.dump(self.failures, file, indent=4)
+        logging.warning(
+            f'{len(self.failures)} LLM request(s) permanently failed, see {path}')
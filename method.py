@@ -17,12 +17,17 @@ from method_signature import MethodSignature
 
 
 class Method:
-    def __init__(self, signature: MethodSignature, body: str, comment: str, parent_class: dict, is_constructor: bool) -> None:
+    def __init__(self, signature: MethodSignature, body: str, comment: str, parent_class: dict, is_constructor: bool, start: int = None, end: int = None, start_line: int = None, end_line: int = None) -> None:
         self.signature = signature
         self.body = body
         self.comment = comment
         self.parent_class = parent_class
         self.is_constructor = is_constructor
+        # Offsets and 1-based lines of the whole declaration in the source file
+        self.start = start
+        self.end = end
+        self.start_line = start_line
+        self.end_line = end_line
 
     def __str__(self) -> str:
         body_indent = ""
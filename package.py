@@ -23,6 +23,8 @@ class Package:
         self.static_analysis_data = static_analysis_data
         self.source_code = source_code
         self.test_code = test_code
+        # Rendered reference context shared by all prompts of the package, filled in by prompts.get_reference_package_info
+        self.reference_package_info = None
 
     def __str__(self):
 
@@ -0,0 +1,147 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import zlib
+import java_parser
+from method import Method
+from method_signature import MethodSignature
+
+CACHE_DIRECTORY = 'parse_cache'
+
+
+def parser_version() -> str:
+    """Version of the parser output, changes whenever the parser module changes
+
+    Returns:
+        str: version string stored with every entry
+    """
+    with open(java_parser.__file__, 'rb') as file:
+        source_hash = hashlib.sha256(file.read()).hexdigest()[:16]
+    return f'{java_parser.PARSER_VERSION}-{source_hash}'
+
+
+class ParseCache:
+    def __init__(self, directory: str = CACHE_DIRECTORY) -> None:
+        self.directory = Path(directory)
+        self.version = parser_version()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, file: Path) -> Path:
+        key = hashlib.sha1(str(file.absolute()).encode('utf-8')).hexdigest()
+        return self.directory.joinpath(f'{key}.json.z')
+
+    def load(self, file: Path) -> tuple[str, dict]:
+        """Get the parsed contents of a file. Size and mtime are checked first, the content hash only when they differ
+
+        Args:
+            file (Path): Path of the java file
+
+        Returns:
+            tuple[str, dict]: content hash of the file and the parsed contents, which are None on a miss
+        """
+        stat = file.stat()
+        try:
+            with open(self._entry_path(file), 'rb') as entry_file:
+                entry = json.loads(zlib.decompress(entry_file.read()))
+        except (FileNotFoundError, zlib.error, ValueError):
+            return None, None
+        if entry['version'] != self.version:
+            return None, None
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['hash'], deserialize(entry['parsed'])
+
+        content_hash = hash_file(file)
+        if content_hash != entry['hash']:
+            return content_hash, None
+        # Touched but unchanged, refresh the fast check for next time
+        self.store(file, content_hash, entry['parsed'], stat, serialized=True)
+        return content_hash, deserialize(entry['parsed'])
+
+    def store(self, file: Path, content_hash: str, parsed: dict, stat: os.stat_result, serialized: bool = False):
+        """Save the parsed contents of a file
+
+        Args:
+            file (Path): Path of the java file
+            content_hash (str): hash of the contents that were parsed
+            parsed (dict): output of parse_java
+            stat (os.stat_result): stat of the file taken before it was read, so a write during parsing is a miss
+                next time instead of being cached under the old contents
+            serialized (bool): if parsed is already in its serialized form
+        """
+        entry = {'version': self.version,
+                 'size': stat.st_size,
+                 'mtime': stat.st_mtime_ns,
+                 'hash': content_hash,
+                 'parsed': parsed if serialized else serialize(parsed)}
+        entry_path = self._entry_path(file)
+        temp_path = entry_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temp_path, 'wb') as entry_file:
+            entry_file.write(zlib.compress(json.dumps(
+                entry, separators=(',', ':')).encode('utf-8')))
+        os.replace(temp_path, entry_path)
+
+
+def hash_file(file: Path) -> str:
+    with open(file, 'r') as input_file:
+        return hash_content(input_file.read())
+
+
+def hash_content(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def serialize(parsed: dict) -> dict:
+    """Turn the output of parse_java into plain json values. Methods become lists, with their class as an index
+
+    Args:
+        parsed (dict): output of parse_java
+
+    Returns:
+        dict: json serializable form
+    """
+    class_indexes = {id(signature): i for i, signature in enumerate(
+        parsed['class_signatures'])}
+    methods = []
+    for method in parsed['methods']:
+        signature = method.signature
+        methods.append([signature.access, signature.modifiers, signature.ret_val, signature.name,
+                        signature.parameters, signature.exceptions, method.body, method.comment,
+                        class_indexes.get(id(method.parent_class), -1), method.is_constructor,
+                        method.start, method.end, method.start_line, method.end_line])
+    return dict(parsed, methods=methods)
+
+
+def deserialize(serialized: dict) -> dict:
+    """Rebuild the output of parse_java from its serialized form
+
+    Args:
+        serialized (dict): output of serialize
+
+    Returns:
+        dict: same contents as parse_java returned
+    """
+    class_signatures = serialized['class_signatures']
+    methods = []
+    for (access, modifiers, ret_val, name, parameters, exceptions, body, comment,
+         class_index, is_constructor, start, end, start_line, end_line) in serialized['methods']:
+        signature = MethodSignature(
+            access, modifiers, ret_val, name, parameters, exceptions)
+        parent_class = class_signatures[class_index] if class_index >= 0 else None
+        methods.append(Method(signature, body, comment, parent_class, is_constructor,
+                              start=start, end=end, start_line=start_line, end_line=end_line))
+    return dict(serialized, methods=methods)
@@ -0,0 +1,75 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import queue
+import threading
+from typing import Iterable, Iterator
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+def buffered(items: Iterable, maxsize: int, name: str = None) -> Iterator:
+    """Run a stage of the pipeline on its own thread, handing its items over through a bounded queue.
+    The stage can work up to maxsize items ahead of its consumer, and blocks once it is that far ahead
+
+    Args:
+        items (Iterable): the stage, usually a generator
+        maxsize (int): how many items can wait in the queue
+        name (str): name of the stage's thread, shown in logs and traces
+
+    Yields:
+        the items of the stage, in order. An exception raised by the stage is re-raised here.
+        If the consumer stops early, the stage is stopped after its next item
+    """
+    handoff = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                handoff.put(item)
+                if stopped.is_set():
+                    break
+        except BaseException as e:
+            if not stopped.is_set():
+                handoff.put(_Failure(e))
+            return
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+        if not stopped.is_set():
+            handoff.put(_DONE)
+
+    threading.Thread(target=produce, name=name, daemon=True).start()
+    try:
+        while True:
+            item = handoff.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        # Make room for a stage blocked on a full queue, so it sees it was stopped
+        while True:
+            try:
+                handoff.get_nowait()
+            except queue.Empty:
+                break
@@ -12,19 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from pathlib import Path
+from typing import Iterable
+import tracing
 import logging
 from logging_config import configure_logging
 configure_logging()
 
 
-def postprocess(results: dict):
+def postprocess(results: Iterable[tuple[Path, str]]) -> list[Path]:
     """Process the results from the LLM. Clean up text, save to file
 
     Args:
-        results (dict): the results from the LLM
+        results (Iterable[tuple[Path, str]]): test paths and the results from the LLM, may be a stream
+
+    Returns:
+        list[Path]: paths of the saved test files
     """
     count = 0
-    for path, result in results.items():
+    saved = []
+    for path, result in results:
         content = remove_excess_text(result)
         content = rename_test(path.stem, content)
         count += count_tests(content)
@@ -33,7 +39,9 @@ def postprocess(results: dict):
         except Exception as e:
             logging.warning(f'Failed saving file: {e}')
             continue
+        saved.append(path)
     logging.info(f'Generated a total of {count} tests')
+    return saved
 
 
 def count_tests(content: str) -> int:
@@ -57,9 +65,10 @@ def save(path: str, content: str):
     """
     logging.info(
         f'Writing tests to {str(Path(path).relative_to(Path("./target_repository/").absolute()))}')
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, 'w') as file:
-        file.write(content)
+    with tracing.span('save', file=str(path), characters=len(content)):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
 
 
 def rename_test(name: str, content: str) -> str:
@@ -89,7 +98,8 @@ def remove_excess_text(content: str) -> str:
     Returns:
         str: cleaned up text
     """
-    llm_comments_start = content.index("```java") + len("```java")
-    content = content[llm_comments_start:]
+    if "```java" in content:
+        llm_comments_start = content.index("```java") + len("```java")
+        content = content[llm_comments_start:]
     content = content.replace('```', '')
     return content
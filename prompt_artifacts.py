@@ -0,0 +1,111 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+from pathlib import Path
+import queue
+import threading
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+PROMPTS_DIRECTORY = 'final_prompts'
+MODES = ('off', 'jsonl', 'files')
+JSONL_NAME = 'prompts.jsonl.gz'
+
+_CLOSE = object()
+
+
+class PromptArtifactSink:
+    def __init__(self, mode: str = 'files', directory: str = PROMPTS_DIRECTORY, maxsize: int = 10000) -> None:
+        """Writes the final prompts to disk on a background thread, so building prompts never waits on it.
+        Use it as a context manager, leaving it waits for everything to be written
+
+        Args:
+            mode (str): 'off' writes nothing, 'jsonl' appends every prompt to one gzipped jsonl file,
+                'files' writes one json file per prompt
+            directory (str): directory the prompts are written to, previous prompts are removed from it
+            maxsize (int): how many prompts can wait to be written before write blocks
+        """
+        if mode not in MODES:
+            raise ValueError(f'Unknown prompt artifact mode {mode}')
+        self.mode = mode
+        self.directory = Path(directory)
+        self.count = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        if self.mode != 'off':
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread:
+            self._queue.put(_CLOSE)
+            self._thread.join()
+            self._thread = None
+
+    def write(self, name: str, prompt: dict):
+        """Queue a prompt to be written
+
+        Args:
+            name (str): name of the prompt, unique within the run
+            prompt (dict): the finished prompt
+        """
+        if self._thread:
+            self._queue.put((name, prompt))
+
+    def _run(self):
+        try:
+            self._write_all()
+        except Exception as e:
+            logging.error(f'Failed writing final prompts: {e}')
+            # Keep draining so prompt construction never blocks on a dead writer
+            if not self._closed:
+                for _ in iter(self._queue.get, _CLOSE):
+                    pass
+
+    def _write_all(self):
+        self._clean_up()
+        if self.mode == 'jsonl':
+            path = self.directory.joinpath(JSONL_NAME)
+            with gzip.open(path, 'wt', compresslevel=1) as file:
+                for name, prompt in iter(self._queue.get, _CLOSE):
+                    file.write(json.dumps(dict(prompt, name=name)))
+                    file.write('\n')
+                    self.count += 1
+                self._closed = True
+        else:
+            for name, prompt in iter(self._queue.get, _CLOSE):
+                with open(self.directory.joinpath(f'final_prompt-{name}.json'), 'w') as file:
+                    json.dump(prompt, file, indent=4)
+                self.count += 1
+            self._closed = True
+        logging.info(f'Wrote {self.count} final prompts to {self.directory}')
+
+    def _clean_up(self):
+        """Remove previously generated prompts. Only the files a sink writes are removed, the directory may hold the
+        prompts of other sinks in subdirectories
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        previous = [path for path in self.directory.iterdir() if path.is_file() and (
+            path.name == JSONL_NAME or (path.name.startswith('final_prompt-') and path.suffix == '.json'))]
+        if previous:
+            logging.info('Removing previously populated prompts')
+        for path in previous:
+            path.unlink()
@@ -0,0 +1,183 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from typing import Iterable, Iterator
+from context_budget import estimate_tokens, json_tokens, find_parent
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+TARGET_KEYS = ('target_method_comment',
+               'target_method_signature', 'target_method_body')
+# Context fields made for one method, like the static analysis issues in its lines. They go with the target method
+METHOD_KEYS = ('static_code_analysis',)
+PACKED_KEY = 'target_methods'
+# Every method needs its own test class in the response, which is capped by max_output_tokens
+DEFAULT_MAX_METHODS = 4
+# Room left in the response for the test class of each packed method
+OUTPUT_TOKENS_PER_METHOD = 400
+MARKER = '// TARGET METHOD {}'
+MARKER_PATTERN = re.compile(r'[ \t]*//\s*TARGET METHOD\s+(\d+)[ \t]*\n?')
+CODE_BLOCK_PATTERN = re.compile(r'```java(.*?)```', re.DOTALL)
+PACK_INSTRUCTIONS = ('\n- The source_code has several target_methods. Write a separate test class for each of them, '
+                     'in the same order, each in its own ```java code block starting with the line '
+                     f'{MARKER.format("<n>")} where <n> is the position of the method, starting at 1')
+
+
+def split_target(context: dict) -> tuple[dict, dict]:
+    """Separate the target method from the rest of a prompt context
+
+    Args:
+        context (dict): rendered prompt context
+
+    Returns:
+        tuple[dict, dict]: copy of the context without the target method, and the target method fields with the
+            other fields made for the method. Both are None if the context has no target method
+    """
+    parent = find_parent(context, TARGET_KEYS[0])
+    if parent is None or any(key not in parent for key in TARGET_KEYS):
+        return None, None
+    target = {key: parent[key] for key in TARGET_KEYS}
+    stripped = {key: value for key, value in parent.items()
+                if key not in TARGET_KEYS}
+    # Marks where the packed target methods go
+    stripped[PACKED_KEY] = None
+    shared = stripped if parent is context else {key: (stripped if value is parent else value)
+                                                 for key, value in context.items()}
+    for key in METHOD_KEYS:
+        if key in shared:
+            target[key] = shared.pop(key)
+    return shared, target
+
+
+def packed_prompt(question: str, shared: dict, targets: list[dict]) -> dict:
+    # The dict holding the marker was copied by split_target, so it can be filled in
+    find_parent(shared, PACKED_KEY)[PACKED_KEY] = targets
+    return {'question': question + PACK_INSTRUCTIONS, 'context': shared, 'methods': len(targets)}
+
+
+def methods_per_response(output_tokens: int, max_methods: int = DEFAULT_MAX_METHODS) -> int:
+    """Most methods whose test classes fit in one response
+
+    Args:
+        output_tokens (int): max_output_tokens of a request
+        max_methods (int): maximum methods in one request
+
+    Returns:
+        int: the methods, at least 1
+    """
+    return max(1, min(max_methods, output_tokens // OUTPUT_TOKENS_PER_METHOD))
+
+
+def pack_prompts(prompts: list[dict], budget: int, max_methods: int = DEFAULT_MAX_METHODS) -> list[dict]:
+    """Group the prompts of a file into fewer requests, each up to a token budget. Consecutive prompts are
+    packed together when their contexts only differ by the target method, so the shared context is sent once
+
+    Args:
+        prompts (list[dict]): prompts of the methods of one file, in order
+        budget (int): maximum estimated tokens of a packed request
+        max_methods (int): maximum methods in one request, see methods_per_response
+
+    Returns:
+        list[dict]: prompts, packed ones have a 'methods' count and their target methods in 'target_methods'
+    """
+    packed = []
+    pack = []
+    pack_shared = None
+    pack_tokens = 0
+
+    def flush():
+        if len(pack) == 1:
+            packed.append(pack[0][0])
+        elif pack:
+            packed.append(packed_prompt(pack[0][0]['question'], pack_shared,
+                                        [target for _, target in pack]))
+
+    for prompt in prompts:
+        shared, target = split_target(prompt['context'])
+        if shared is None:
+            flush()
+            pack, pack_shared = [], None
+            packed.append(prompt)
+            continue
+        target_tokens = json_tokens(target)
+        if (pack and shared == pack_shared and len(pack) < max_methods
+                and pack_tokens + target_tokens <= budget):
+            pack.append((prompt, target))
+            pack_tokens += target_tokens
+            continue
+        flush()
+        pack, pack_shared = [(prompt, target)], shared
+        pack_tokens = estimate_tokens(prompt['question'] + PACK_INSTRUCTIONS) + \
+            json_tokens(shared) + target_tokens
+    flush()
+    return packed
+
+
+def split_response(text: str, methods: int) -> list[str]:
+    """Split the response to a packed prompt into the tests of each method
+
+    Args:
+        text (str): response from the LLM
+        methods (int): number of methods the prompt asked tests for
+
+    Returns:
+        list[str]: one fenced java code block per method. If the response can not be split by method, every java code
+            block in it, for the tests to be merged, or the whole response if it has none
+    """
+    if methods <= 1:
+        return [text]
+    blocks = CODE_BLOCK_PATTERN.findall(text)
+    if len(blocks) == methods:
+        return [f'```java{MARKER_PATTERN.sub("", block)}```' for block in blocks]
+    code = '\n'.join(blocks) if blocks else text
+    markers = list(MARKER_PATTERN.finditer(code))
+    if len(markers) == methods:
+        ends = [marker.start() for marker in markers[1:]] + [len(code)]
+        return [f'```java\n{code[marker.end():end]}```' for marker, end in zip(markers, ends)]
+    if blocks:
+        logging.warning(
+            f'Expected tests for {methods} methods, got {len(blocks)} code blocks. Merging them as they are')
+        return [f'```java{MARKER_PATTERN.sub("", block)}```' for block in blocks]
+    return [text]
+
+
+def iter_packed(prompts: Iterable[tuple[str, list[dict]]], budget: int, max_methods: int = DEFAULT_MAX_METHODS,
+                output_tokens: int = None) -> Iterator[tuple[str, list[dict]]]:
+    """Pack the prompts of every file of a stream, see pack_prompts
+
+    Args:
+        prompts (Iterable[tuple[str, list[dict]]]): source file paths and their prompts
+        budget (int): maximum estimated tokens of a packed request
+        max_methods (int): maximum methods in one request
+        output_tokens (int): max_output_tokens of a request, packs are kept small enough for their tests to fit in it
+
+    Yields:
+        tuple[str, list[dict]]: source file path and its packed prompts
+    """
+    if output_tokens:
+        fitting = methods_per_response(output_tokens, max_methods)
+        if fitting < max_methods:
+            logging.info(
+                f'Packing up to {fitting} methods per request, the tests of more would not fit in {output_tokens} output tokens')
+        max_methods = fitting
+    count = 0
+    packed_count = 0
+    for path, file_prompts in prompts:
+        packed = pack_prompts(file_prompts, budget, max_methods)
+        count += len(file_prompts)
+        packed_count += len(packed)
+        yield path, packed
+    logging.info(f'Packed {count} prompts into {packed_count} requests')
@@ -0,0 +1,126 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+import json
+from pathlib import Path
+import threading
+from context_budget import estimate_tokens, json_tokens
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+PERCENTILES = (50, 90, 99)
+WORST_FILES = 20
+
+
+def field_tokens(context: dict, prefix: str = '') -> dict:
+    """Estimate the tokens of every field of a prompt context, nested fields are named by their path
+
+    Args:
+        context (dict): rendered prompt context
+        prefix (str): path of the dict within the context
+
+    Returns:
+        dict: estimated token count of every leaf field
+    """
+    tokens = {}
+    for key, value in context.items():
+        if isinstance(value, dict):
+            tokens.update(field_tokens(value, f'{prefix}{key}.'))
+        else:
+            tokens[f'{prefix}{key}'] = json_tokens(value)
+    return tokens
+
+
+def percentile(values: list[int], percent: int) -> int:
+    """Nearest-rank percentile
+
+    Args:
+        values (list[int]): sorted values
+        percent (int): percentile to get, 0 to 100
+
+    Returns:
+        int: the percentile
+    """
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[rank - 1]
+
+
+def summarize(values: list[int]) -> dict:
+    values = sorted(values)
+    summary = {'count': len(values),
+               'total': sum(values),
+               'mean': round(sum(values) / len(values), 1)}
+    for percent in PERCENTILES:
+        summary[f'p{percent}'] = percentile(values, percent)
+    summary['max'] = values[-1]
+    return summary
+
+
+class PromptProfiler:
+    def __init__(self) -> None:
+        self.fields = defaultdict(list)
+        self.totals = []
+        self.files = defaultdict(lambda: {'prompts': 0, 'total': 0, 'max': 0})
+        self.lock = threading.Lock()
+
+    def record(self, file: str, prompt: dict):
+        """Record the size of a finished prompt
+
+        Args:
+            file (str): source file the prompt was made for
+            prompt (dict): prompt with its 'question' and 'context'
+        """
+        tokens = field_tokens(prompt['context'])
+        tokens['question'] = estimate_tokens(prompt['question'])
+        total = sum(tokens.values())
+        with self.lock:
+            for field, count in tokens.items():
+                self.fields[field].append(count)
+            self.totals.append(total)
+            file_stats = self.files[file]
+            file_stats['prompts'] += 1
+            file_stats['total'] += total
+            file_stats['max'] = max(file_stats['max'], total)
+
+    def report(self) -> dict:
+        """Aggregate the recorded prompts
+
+        Returns:
+            dict: per prompt totals, per field statistics sorted by total tokens, and the files with the most tokens
+        """
+        if not self.totals:
+            return {'prompts': 0, 'fields': {}, 'worst_files': []}
+        fields = {field: summarize(counts) for field, counts in
+                  sorted(self.fields.items(), key=lambda item: sum(item[1]), reverse=True)}
+        worst_files = sorted(self.files.items(),
+                             key=lambda item: item[1]['total'], reverse=True)[:WORST_FILES]
+        return {'prompts': len(self.totals),
+                'prompt_tokens': summarize(self.totals),
+                'fields': fields,
+                'worst_files': [dict(stats, file=file) for file, stats in worst_files]}
+
+    def write(self, path: str):
+        """Write the report as json
+
+        Args:
+            path (str): file to write the report to
+        """
+        report = self.report()
+        with open(Path(path), 'w') as file:
+            json.dump(report, file, indent=4)
+        if report['prompts']:
+            logging.info(
+                f'Profiled {report["prompts"]} prompts, p90 size {report["prompt_tokens"]["p90"]} tokens, report in {path}')
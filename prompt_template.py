@@ -0,0 +1,114 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from pathlib import Path
+from string import Formatter
+
+DEFAULT_TEMPLATE = 'template_prompts/methodprompt2.json'
+# Context key that receives the rendered reference_package_info_item list
+REFERENCE_KEY = 'reference_package_info'
+
+_formatter = Formatter()
+
+
+def compile_text(text: str) -> tuple[tuple]:
+    """Resolve the placeholders of a template string ahead of time
+
+    Args:
+        text (str): string in str.format syntax
+
+    Returns:
+        tuple[tuple]: (literal, field name, conversion, format spec) parts, field name is None for trailing text
+    """
+    return tuple((literal, field, conversion, spec)
+                 for literal, field, spec, conversion in _formatter.parse(text))
+
+
+def render_text(parts: tuple[tuple], values: dict) -> str:
+    """Same result as str.format(**values) on the text the parts were compiled from
+
+    Args:
+        parts (tuple[tuple]): output of compile_text
+        values (dict): values for the placeholders
+
+    Returns:
+        str: rendered text
+    """
+    rendered = []
+    for literal, field, conversion, spec in parts:
+        rendered.append(literal)
+        if field is None:
+            continue
+        value = _formatter.get_field(field, (), values)[0]
+        if conversion:
+            value = _formatter.convert_field(value, conversion)
+        rendered.append(format(value, spec or ''))
+    return ''.join(rendered)
+
+
+def compile_tree(template):
+    if isinstance(template, dict):
+        return {key: compile_tree(value) for key, value in template.items()}
+    if isinstance(template, str):
+        return compile_text(template)
+    return template
+
+
+def render_tree(compiled, values: dict):
+    if isinstance(compiled, dict):
+        return {key: render_tree(value, values) for key, value in compiled.items()}
+    if isinstance(compiled, tuple):
+        return render_text(compiled, values)
+    return compiled
+
+
+class PromptTemplate:
+    def __init__(self, path: str = DEFAULT_TEMPLATE) -> None:
+        """Load and compile a prompt template. It has a 'context' dict to fill in, the 'question' sent as is,
+        and optionally a 'reference_package_info_item' rendered for every reference class
+
+        Args:
+            path (str): path to the json template
+        """
+        self.path = Path(path)
+        with open(self.path, 'r') as file:
+            data = json.load(file)
+        self.context = compile_tree(data['context'])
+        self.question = data['question']
+        self.reference_item = compile_tree(
+            data.get('reference_package_info_item', {}))
+
+    def render_reference_item(self, reference: dict) -> dict:
+        return render_tree(self.reference_item, reference)
+
+    def render(self, values: dict) -> dict:
+        """Render the request payload for one prompt
+
+        Args:
+            values (dict): template values, reference_package_info holding already rendered reference items
+
+        Returns:
+            dict: 'question' string and 'context' dict
+        """
+        context_values = dict(values)
+        context_values[REFERENCE_KEY] = ''
+        try:
+            context = render_tree(self.context, context_values)
+        except KeyError as e:
+            raise KeyError(
+                f'Template {self.path} uses {e} which has no value') from e
+        if REFERENCE_KEY in context:
+            context[REFERENCE_KEY] = values.get(REFERENCE_KEY, [])
+        return {'question': self.question, 'context': context}
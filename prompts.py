@@ -16,31 +16,67 @@ from package import Package
 from code_file import CodeFile
 from langugageLookup import language_data
 from method import Method
+from prompt_template import PromptTemplate
+from prompt_artifacts import PromptArtifactSink
+from context_budget import fit_context, estimate_tokens, json_tokens
+from prompt_profile import PromptProfiler
+import tracing
 import json
 from pathlib import Path
+from typing import Iterable, Iterator
 import logging
-import os
 from logging_config import configure_logging
 configure_logging()
 
 
-def fill_out_prompts(packages: list[Package]) -> dict:
+def fill_out_prompts(packages: list[Package], changed_files: set[str] = None, template: PromptTemplate = None, artifacts: PromptArtifactSink = None, max_tokens: int = None, profiler: PromptProfiler = None) -> dict:
     """Fills out 1 single prompt for every method in the repository
 
     Args:
         packages (list[Package]): all the package data in the repository
+        changed_files (set[str]): Absolute paths of the files to prompt for, None for every file
+        template (PromptTemplate): compiled prompt template, None for the default one
+        artifacts (PromptArtifactSink): where the final prompts are saved, None for one file per prompt
+        max_tokens (int): token budget of a single prompt, larger contexts are pruned. None for no limit
+        profiler (PromptProfiler): records the size of every prompt, None to skip profiling
 
     Returns:
         dict: all prompts with their file path as the key
     """
-    clean_up()
-    prompts = {}
+    return dict(iter_prompts(packages, changed_files, template, artifacts, max_tokens, profiler))
+
+
+def iter_prompts(packages: Iterable[Package], changed_files: set[str] = None, template: PromptTemplate = None, artifacts: PromptArtifactSink = None, max_tokens: int = None, profiler: PromptProfiler = None) -> Iterator[tuple[str, list[dict]]]:
+    """Same as fill_out_prompts, but yields the prompts of each file as soon as they are ready
+
+    Args:
+        packages (Iterable[Package]): all the package data in the repository, may be a stream
+        changed_files (set[str]): Absolute paths of the files to prompt for, None for every file
+        template (PromptTemplate): compiled prompt template, None for the default one
+        artifacts (PromptArtifactSink): where the final prompts are saved, None for one file per prompt
+        max_tokens (int): token budget of a single prompt, larger contexts are pruned. None for no limit
+        profiler (PromptProfiler): records the size of every prompt, None to skip profiling
+
+    Yields:
+        tuple[str, list[dict]]: file path, and the prompts for its methods
+    """
+    if template is None:
+        template = PromptTemplate()
+    if artifacts is None:
+        artifacts = PromptArtifactSink()
+    with artifacts:
+        yield from _iter_prompts(packages, changed_files, template, artifacts, max_tokens, profiler)
+
+
+def _iter_prompts(packages: Iterable[Package], changed_files: set[str], template: PromptTemplate, artifacts: PromptArtifactSink, max_tokens: int, profiler: PromptProfiler) -> Iterator[tuple[str, list[dict]]]:
     count = 0
     for package in packages:
         for file, code_file in package.source_code.items():
             if code_file.class_signatures[0]['type'] == 'interface':
                 continue
-            prompts[file] = []
+            if changed_files is not None and file not in changed_files:
+                continue
+            file_prompts = []
             logging.info(
                 f'Preparing prompts for: {str(Path(file).relative_to(Path("./target_repository/").absolute()))}')
             i = 0
@@ -50,29 +86,19 @@ def fill_out_prompts(packages: list[Package]) -> dict:
                     continue
 
                 template_values = gather_template_values(
-                    package, code_file, method)
-                prompt = populate_template(template_values, i)
-                prompts[file].append(prompt)
+                    package, code_file, method, template)
+                prompt = populate_template(
+                    template_values, i, template, artifacts, max_tokens)
+                if profiler:
+                    profiler.record(file, prompt)
+                file_prompts.append(prompt)
                 count += 1
                 i += 1
+            yield file, file_prompts
     logging.info(f'Prepared {count} prompts for repository')
-    return prompts
-
-
-def clean_up():
-    """Remove previously generated prompts
-    """
-    file_list = os.listdir('final_prompts')
-    if file_list:
-        logging.info('Removing previously populated prompts')
-
-    for file_name in file_list:
-        file_path = os.path.join('final_prompts', file_name)
-        if os.path.isfile(file_path):
-            os.remove(file_path)
 
 
-def gather_template_values(package: Package, code_file: CodeFile, method: Method) -> dict:
+def gather_template_values(package: Package, code_file: CodeFile, method: Method, template: PromptTemplate) -> dict:
     """Populate all of the template values for the prompt
 
     Args:
@@ -80,6 +106,7 @@ def gather_template_values(package: Package, code_file: CodeFile, method: Method
         package (Package): package we are processing
         code_file (CodeFile): file we are processing
         method (Method): method we are processing
+        template (PromptTemplate): template the reference context is rendered with
 
     Returns:
         dict: template values for prompt
@@ -91,7 +118,7 @@ def gather_template_values(package: Package, code_file: CodeFile, method: Method
     template_data['logging_framework'] = language_data['java']["logging"][0]
     template_data['testing_framework'] = language_data['java']["testing_frameworks"][0]['name']
     template_data['testing_framework_generic_import'] = language_data['java']["testing_frameworks"][0]['generic_import']
-    template_data['static_code_analysis'] = code_file.static_code_analysis
+    template_data['static_code_analysis'] = code_file.issues_for(method)
     template_data['target_method_comment'] = method.comment
     template_data['target_method_signature'] = json.dumps(
         method.signature.to_dict())
@@ -111,8 +138,8 @@ def gather_template_values(package: Package, code_file: CodeFile, method: Method
 
     template_data['class_imports'] = code_file.imports
 
-    template_data['reference_package_info'] = []
-    create_reference_context(package, template_data)
+    template_data['reference_package_info'] = get_reference_package_info(
+        package, template)
     template_data['code_imports'] = code_file.imports
     template_data['notes'] = ''
     template_data['class_comments'] = code_file.class_comments
@@ -120,13 +147,33 @@ def gather_template_values(package: Package, code_file: CodeFile, method: Method
     return template_data
 
 
-def create_reference_context(package: Package, template_data: dict):
+def get_reference_package_info(package: Package, template: PromptTemplate) -> list[dict]:
+    """Reference context rendered with the reference_package_info_item template. It only depends on the package,
+    so it is built once and shared by the prompts of every method in the package
+
+    Args:
+        package (Package): all the information for the package that tests are being generated for
+        template (PromptTemplate): template the reference items are rendered with
+
+    Returns:
+        list[dict]: rendered reference_package_info items
+    """
+    if package.reference_package_info is None:
+        package.reference_package_info = [template.render_reference_item(reference)
+                                          for reference in create_reference_context(package)]
+    return package.reference_package_info
+
+
+def create_reference_context(package: Package) -> list[dict]:
     """Setup reference context, all other code in the same package as method that is having tests generated
 
     Args:
         package (Package): all the information for the package that tests are being generated for
-        template_data (_type_): template to fill in
+
+    Returns:
+        list[dict]: reference info of every source file in the package
     """
+    reference_context = []
     for source_code in package.source_code.values():
         info = {}
         for clas in source_code.class_signatures:
@@ -144,7 +191,8 @@ def create_reference_context(package: Package, template_data: dict):
             info['class_comments'] = source_code.class_comments
             info['class_methods'] = [
                 json.dumps(meth.signature.to_dict()) if meth.signature else "" for meth in source_code.methods]
-        template_data['reference_package_info'].append(info)
+        reference_context.append(info)
+    return reference_context
 
 
 def populate_reference_methods(methods: list[Method], template_data: dict):
@@ -182,46 +230,25 @@ def populate_reference_class_signature(template_data: dict, class_signatures: li
     template_data['reference_package_info'].append(reference_sig)
 
 
-def populate_template(template_data: dict, prompt_val: int) -> dict:
+def populate_template(template_data: dict, prompt_val: int, template: PromptTemplate, artifacts: PromptArtifactSink, max_tokens: int = None) -> dict:
     """Using the template values, populate the template prompt
 
     Args:
         template_data (dict): dict of all the values we have preprocessed in a form that can be input into the template
+        prompt_val (int): index of the prompt within its file
+        template (PromptTemplate): compiled template to render
+        artifacts (PromptArtifactSink): where the final prompt is saved
+        max_tokens (int): token budget of the prompt, a larger context is pruned. None for no limit
 
     Returns:
-        dict: the finished prompt
-    """
-    with open("template_prompts/methodprompt2.json", "r") as file:
-        data = json.load(file)
-
-        format_nested_dictionary(data["context"], template_data)
-        data['context']['reference_package_info'] = []
-        for reference in template_data['reference_package_info']:
-            prompt_item = data['reference_package_info_item']
-            template_item = {}
-            for key, val in prompt_item.items():
-                formatted_value = val.format(**reference)
-                template_item[key] = formatted_value
-            data['context']['reference_package_info'].append(template_item)
-        prompt_file_path = f'final_prompts/final_prompt-{data["context"]["test_name"]}-{prompt_val}.json'
-        with open(prompt_file_path, 'w') as file:
-            logging.info(f'Writing final prompt to {prompt_file_path}')
-            json.dump(data, file, indent=4)
-        json_data = json.dumps(data['context'])
-        return {'question': data['question'], 'context': json_data}
-
-
-def format_nested_dictionary(template_dict: dict, value_dict: dict) -> None:
-    """Format nested dictionary for prompt
-
-    Args:
-        template_dict (dict): The template to fill in
-        value_dict (dict): the values to fill the template in with
+        dict: the finished prompt, with the 'question' and the 'context' ready to send
     """
-    for key, value in template_dict.items():
-        if isinstance(value, dict):
-            # Recursive call for nested dictionaries
-            format_nested_dictionary(value, value_dict)
-        elif isinstance(value, str):
-            template = value.format(**value_dict)
-            template_dict[key] = template
+    with tracing.span('populate_template', test_name=template_data['test_name'], prompt=prompt_val) as trace_span:
+        prompt = template.render(template_data)
+        if max_tokens:
+            prompt = fit_context(prompt, max_tokens)
+        if tracing.enabled():
+            trace_span.set(method=template_data['target_method_signature'],
+                           prompt_tokens=estimate_tokens(prompt['question']) + json_tokens(prompt['context']))
+    artifacts.write(f'{template_data["test_name"]}-{prompt_val}', prompt)
+    return prompt
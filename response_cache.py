@@ -0,0 +1,157 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+import time
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+CACHE_DIRECTORY = 'llm_cache'
+# 30 days
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+# 512 MB
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+# Once over the max size, entries are evicted until the cache is down to this share of it,
+# so the puts that follow do not scan the cache again right away
+EVICT_TO = 0.9
+
+
+def cache_key(context: str, question: str, model: str, parameters: dict) -> str:
+    """Content address of a request to the LLM
+
+    Args:
+        context (str): context json sent with the chat
+        question (str): message sent to the chat
+        model (str): name of the model
+        parameters (dict): generation parameters
+
+    Returns:
+        str: hex digest identifying the request
+    """
+    payload = json.dumps([context, question, model, parameters],
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, directory: str = CACHE_DIRECTORY, max_age: int = DEFAULT_MAX_AGE, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = Path(directory)
+        self.max_age = max_age
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.evict()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory.joinpath(key[:2], f'{key}.txt')
+
+    def get(self, context: str, question: str, model: str, parameters: dict) -> str:
+        """Look up a previous response. A hit sets the access time of the entry, which eviction goes by
+
+        Returns:
+            str: the cached response text, None on a miss
+        """
+        path = self._entry_path(cache_key(context, question, model, parameters))
+        try:
+            now = time.time()
+            stat = path.stat()
+            modified = stat.st_mtime
+            if now - modified > self.max_age:
+                path.unlink()
+                with self._lock:
+                    self.size -= stat.st_size
+                raise FileNotFoundError(path)
+            with open(path, 'r') as file:
+                text = file.read()
+            # The modification time stays the time the response was received, the max age goes by it
+            os.utime(path, (now, modified))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, context: str, question: str, model: str, parameters: dict, text: str):
+        """Store a response, written to a temporary file first so readers never see a partial entry.
+        Entries are evicted once the cache grows over the max size
+        """
+        path = self._entry_path(cache_key(context, question, model, parameters))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        with open(temp_path, 'w') as file:
+            file.write(text)
+        size = temp_path.stat().st_size
+        try:
+            size -= path.stat().st_size
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, path)
+        with self._lock:
+            self.size += size
+            over = self.size > self.max_size
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Remove entries older than the max age. If the cache is still over the max size, remove the least recently
+        used entries until it is down to EVICT_TO of it
+        """
+        # Concurrent puts over the max size evict once
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self._evict()
+        finally:
+            self._evict_lock.release()
+
+    def _evict(self):
+        now = time.time()
+        entries = []
+        for path in self.directory.glob('*/*.txt'):
+            try:
+                stat = path.stat()
+                if now - stat.st_mtime > self.max_age:
+                    path.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_size:
+            entries.sort()
+            removed = 0
+            for _, size, path in entries:
+                if total <= self.max_size * EVICT_TO:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+            logging.info(f'Evicted {removed} responses from the LLM cache')
+        with self._lock:
+            self.size = total
+
+    def stats(self) -> str:
+        return f'cache hits: {self.hits}, cache misses: {self.misses}'
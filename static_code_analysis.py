@@ -13,24 +13,52 @@
 # limitations under the License.
 
 from sonarqube import SonarQubeClient
+from git import Repo, InvalidGitRepositoryError
+import hashlib
+import json
+import requests
 import subprocess
 from pathlib import Path
+import threading
 import time
 import os
+from compile_check import QUARANTINE_SUFFIX
+import tracing
 import logging
 from logging_config import configure_logging
 configure_logging()
 
+SONAR_URL = 'http://localhost:9000'
+# Seconds to wait for the server to come up before giving up
+SONAR_START_TIMEOUT = 300
+ANALYSIS_CACHE_DIRECTORY = 'analysis_cache'
+# Largest page the issue search allows, and the most results it returns for one query
+ISSUES_PAGE_SIZE = 500
+ISSUES_SEARCH_LIMIT = 10000
+# Repositories analyzed at the same time share 1 server, only one of them starts it
+_start_lock = threading.Lock()
 
-def analyze(directory: Path) -> dict:
-    """Uses Sonarqube to statically analyze the codebase
+
+def analyze(directory: Path, stop_sonar: bool = False, use_cache: bool = True) -> dict:
+    """Uses Sonarqube to statically analyze the codebase. Results are cached by commit, and a cached
+    result skips Sonarqube and the maven build entirely
 
     Args:
         directory (Path): path to the codebase
+        stop_sonar (bool): stop the Sonarqube server afterwards instead of leaving it up for the next run
+        use_cache (bool): reuse the results of a previous analysis of the same commit
 
     Returns:
         dict: results from the analysis
     """
+    cache_key = analysis_cache_key(directory) if use_cache else None
+    if cache_key:
+        cached_results = load_cached_analysis(cache_key, directory)
+        if cached_results is not None:
+            logging.info(
+                'Reusing the static code analysis of the current commit')
+            tracing.annotate(cached=True)
+            return cached_results
 
     if 'SONAR_USER' not in os.environ or 'SONAR_PASS' not in os.environ:
         logging.error(
@@ -40,30 +68,97 @@ def analyze(directory: Path) -> dict:
     password = os.environ['SONAR_PASS']
     start_sonarqube()
     project = directory.parts[-1]
-    sonar = SonarQubeClient(sonarqube_url="http://localhost:9000",
+    sonar = SonarQubeClient(sonarqube_url=SONAR_URL,
                             username=username, password=password)
-    projects = sonar.projects.search_projects(
-        projects=[project])
-    found = any(component['key'] ==
-                project for component in projects['components'])
 
-    run_analysis(found, str(directory.absolute()), username, password)
-    results = retrieve_results(sonar, project)
+    with tracing.span('run_analysis', project=project):
+        run_analysis(str(directory.absolute()), username, password)
+    with tracing.span('retrieve_results', project=project) as trace_span:
+        results = retrieve_results(sonar, project)
+        trace_span.set(issues=len(results['issues']))
     parsed_results = parse_results(results, directory)
+    if cache_key:
+        save_cached_analysis(cache_key, directory, parsed_results)
 
-    shutdown_sonarqube()
+    if stop_sonar:
+        shutdown_sonarqube()
     return parsed_results
 
 
+def analysis_cache_key(directory: Path) -> str:
+    """Identifies the code being analyzed: the repository, the module path in it, the commit, and any uncommitted changes
+
+    Args:
+        directory (Path): path to the codebase
+
+    Returns:
+        str: cache key, None if the directory is not in a git repository
+    """
+    try:
+        repo = Repo(directory, search_parent_directories=True)
+    except (InvalidGitRepositoryError, OSError):
+        return None
+    if not repo.head.is_valid():
+        return None
+    root = Path(repo.working_tree_dir)
+    module = str(directory.absolute().relative_to(root.absolute()))
+    remote = repo.remotes.origin.url if 'origin' in repo.remotes else str(root.absolute())
+    changes = hashlib.sha256(
+        repo.git.diff('HEAD', '--', module).encode('utf-8'))
+    # Tests generated by previous runs, and the ones quarantined, are untracked but should not invalidate the analysis
+    prefix = '' if module == '.' else f'{module}/'
+    for untracked in sorted(repo.untracked_files):
+        if untracked.startswith(prefix) and not untracked.endswith(('GenTest.java', f'GenTest.java{QUARANTINE_SUFFIX}')):
+            changes.update(untracked.encode('utf-8'))
+            changes.update(root.joinpath(untracked).read_bytes())
+    key = json.dumps(
+        [remote, module, repo.head.commit.hexsha, changes.hexdigest()])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def load_cached_analysis(cache_key: str, directory: Path) -> dict:
+    """Load the results of a previous analysis
+
+    Args:
+        cache_key (str): key from analysis_cache_key
+        directory (Path): path to the codebase
+
+    Returns:
+        dict: results in the same form as parse_results, None if there are none
+    """
+    path = Path(ANALYSIS_CACHE_DIRECTORY).joinpath(f'{cache_key}.json')
+    if not path.is_file():
+        return None
+    with open(path, 'r') as file:
+        relative_results = json.load(file)
+    return {str(directory.absolute().joinpath(relative_path)): issues
+            for relative_path, issues in relative_results.items()}
+
+
+def save_cached_analysis(cache_key: str, directory: Path, parsed_results: dict):
+    """Save the results of an analysis, with paths relative to the codebase so the clone can move
+
+    Args:
+        cache_key (str): key from analysis_cache_key
+        directory (Path): path to the codebase
+        parsed_results (dict): output of parse_results
+    """
+    Path(ANALYSIS_CACHE_DIRECTORY).mkdir(parents=True, exist_ok=True)
+    relative_results = {str(Path(absolute_path).relative_to(directory.absolute())): issues
+                        for absolute_path, issues in parsed_results.items()}
+    with open(Path(ANALYSIS_CACHE_DIRECTORY).joinpath(f'{cache_key}.json'), 'w') as file:
+        json.dump(relative_results, file)
+
+
 def parse_results(results: dict, directory: Path) -> dict:
-    """Parse results from issues - gets all the messages
+    """Parse results from issues - gets all the messages, indexed by file and sorted by line
 
     Args:
         results (dict): the querying results
         directory (Path): path to the repository
 
     Returns:
-        dict: parsed results
+        dict: absolute file path to its issues, each a dict with the 'line' (None for file level issues) and 'message'
     """
     parsed_results = {}
 
@@ -74,7 +169,10 @@ def parse_results(results: dict, directory: Path) -> dict:
         absolute_path = str(directory.absolute().joinpath(relative_path))
         if absolute_path not in parsed_results:
             parsed_results[absolute_path] = []
-        parsed_results[absolute_path].append(issue['message'])
+        parsed_results[absolute_path].append(
+            {'line': issue.get('line'), 'message': issue['message']})
+    for issues in parsed_results.values():
+        issues.sort(key=lambda issue: issue['line'] or 0)
     return parsed_results
 
 
@@ -85,18 +183,19 @@ def shutdown_sonarqube():
     subprocess.Popen(["sonar.sh", "stop"], stdout=subprocess.DEVNULL)
 
 
-def run_analysis(cached: bool, path: str, sonar_user: str, sonar_pass: str):
-    """Runs the analysis of the codebase
+def run_analysis(path: str, sonar_user: str, sonar_pass: str):
+    """Runs the analysis of the codebase. Skipping analyses that are already done is up to the cache in analyze
 
     Args:
-        cached (bool): If the repository has already been analyzed, dont do it again
         path (str): Path to the repository
+        sonar_user (str): Sonarqube user
+        sonar_pass (str): password of the Sonarqube user
     """
     logging.info('Static Code Analysis Starting')
     subprocess.run(
         ["mvn",
          "sonar:sonar",
-         "-Dsonar.host.url=http://localhost:9000",
+         f"-Dsonar.host.url={SONAR_URL}",
          "-Dsonar.jacoco.reportPaths=**/*.xml",
          "-Dsonar.coverage.jacoco.xmlReportPaths=**/*.xml",
          f"-Dsonar.login={sonar_user}",
@@ -108,34 +207,79 @@ def run_analysis(cached: bool, path: str, sonar_user: str, sonar_pass: str):
 
 
 def retrieve_results(sonar: SonarQubeClient, project: str):
-    """Queries the Sonarqube server for static code analysis results
+    """Queries the Sonarqube server for static code analysis results, going through every page
 
     Args:
         sonar (SonarQubeClient): The sonarqube client object to query
         project (str): the project we are querying
 
     Returns:
-        _type_: issues found
+        dict: all the issues found, under 'issues'
     """
     logging.info('Querying for Results')
-    return sonar.issues.search_issues(componentKeys=project, branch="main")
+    issues = []
+    page = 1
+    while True:
+        results = sonar.issues.search_issues(
+            componentKeys=project, branch="main", p=page, ps=ISSUES_PAGE_SIZE)
+        issues.extend(results['issues'])
+        total = results.get('paging', {}).get('total', results.get('total', 0))
+        if not results['issues'] or len(issues) >= min(total, ISSUES_SEARCH_LIMIT):
+            break
+        page += 1
+    if total > ISSUES_SEARCH_LIMIT:
+        logging.warning(
+            f'Sonarqube found {total} issues, only the first {ISSUES_SEARCH_LIMIT} can be retrieved')
+    logging.info(f'Retrieved {len(issues)} issues')
+    return {'issues': issues}
 
 
 def start_sonarqube():
-    """Starts sonarqube in the background, and waits 40 seconds for it to spin up before continuing
+    """Starts sonarqube in the background, unless a server is already up, and waits until it reports it is ready
     """
-    logging.info('Sonarqube Server Starting')
-    subprocess.Popen(["sonar.sh", "console"], stdout=subprocess.DEVNULL)
-    # Sleeps until the server has started.
-    for x in range(0, 40, 10):
-        process = subprocess.Popen(
-            ['sonar.sh', 'status'], stdout=subprocess.PIPE)
-        output = process.stdout.read()
-
-        output = output.decode('utf-8')
-        if 'SonarQube is running' in output:
-            break
+    with _start_lock:
+        status = sonarqube_status()
+        if status == 'UP':
+            logging.info('Reusing the running Sonarqube Server')
+            return
+        if status is None:
+            logging.info('Sonarqube Server Starting')
+            subprocess.Popen(["sonar.sh", "start"], stdout=subprocess.DEVNULL)
+        else:
+            logging.info(f'Sonarqube Server is {status}, waiting for it')
+        wait_for_sonarqube()
+        logging.info('Sonarqube Server Started')
+
 
-        logging.info('Waiting for sonarqube to start')
-        time.sleep(10)
-    logging.info('Sonarqube Server Started')
+def sonarqube_status() -> str:
+    """Asks the server for its status
+
+    Returns:
+        str: status reported by /api/system/status (e.g. 'UP', 'STARTING'), None if the server is not reachable
+    """
+    try:
+        response = requests.get(f'{SONAR_URL}/api/system/status', timeout=2)
+        response.raise_for_status()
+        return response.json().get('status')
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def wait_for_sonarqube(timeout: float = SONAR_START_TIMEOUT):
+    """Polls the server status with a short backoff until it is up, exiting if it never comes up
+
+    Args:
+        timeout (float): seconds to wait before giving up
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.5
+    status = None
+    while time.monotonic() < deadline:
+        status = sonarqube_status()
+        if status == 'UP':
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+    logging.error(
+        f'Sonarqube Server did not come up within {timeout} seconds, last status: {status}')
+    exit(1)
@@ -16,11 +16,24 @@ import argparse
 import logging
 import os
 from pathlib import Path
-from preprocess import preprocess
-from prompts import fill_out_prompts
+from preprocess import iter_packages
+from parse_cache import ParseCache
+from prompts import iter_prompts
+from prompt_template import PromptTemplate, DEFAULT_TEMPLATE
+from prompt_artifacts import PromptArtifactSink, MODES, PROMPTS_DIRECTORY
+from prompt_profile import PromptProfiler
+from prompt_packing import iter_packed, DEFAULT_MAX_METHODS
 import llm
-from git_clone import clone_or_update_repository
-from postprocess import postprocess
+from llm_backends import BACKENDS, RECORDING_FILE, DEFAULT_LOCAL_LATENCY, create_backend
+from response_cache import ResponseCache
+from llm_client import LLMClient, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_MAX_RETRIES
+from git_clone import TARGET_DIRECTORY, clone_or_update_repository, find_changed_files, last_generated_commit, record_generated_commit
+from postprocess import postprocess, count_tests
+from compile_check import validate_tests, COMPILE_REPORT
+from static_code_analysis import shutdown_sonarqube
+from batch import read_repos_file, run_batch, BATCH_SUMMARY, DEFAULT_PARALLEL_REPOSITORIES
+from pipeline import buffered
+import tracing
 from logging_config import configure_logging
 configure_logging()
 
@@ -29,11 +42,95 @@ def setup() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         prog='Test Generation',
         description='Generate Tests using a LLM')
-    parser.add_argument('repo_url',
+    parser.add_argument('repo_url', nargs='?',
                         help='Url to repository')
+    parser.add_argument('--repos-file', metavar='FILE',
+                        help='Generate tests for every repository listed in FILE, one url per line optionally followed by a module')
+    parser.add_argument('--parallel-repos', type=int, default=DEFAULT_PARALLEL_REPOSITORIES,
+                        help='Repositories of the --repos-file worked on at once')
+    parser.add_argument('--batch-summary', default=BATCH_SUMMARY,
+                        help='File the summary of every repository of the --repos-file is written to')
     parser.add_argument('--module', nargs='?', help='Specific Module')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Maximum number of concurrent requests to the LLM')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always send prompts to the LLM instead of reusing cached responses')
+    incremental = parser.add_mutually_exclusive_group()
+    incremental.add_argument('--since', metavar='COMMIT',
+                             help='Only generate tests for java files changed since this commit')
+    incremental.add_argument('--changed-only', action='store_true',
+                             help='Only generate tests for java files changed since the last run')
+    parser.add_argument('--full-clone', action='store_true',
+                        help='Clone the full history and every directory, instead of a shallow or sparse clone')
+    parser.add_argument('--no-mirror', action='store_true',
+                        help='Do not share the downloaded history through the mirror in target_repository/.mirrors')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to parse the source files')
+    parser.add_argument('--no-parse-cache', action='store_true',
+                        help='Parse every source file instead of reusing the parses of unchanged files')
+    parser.add_argument('--template', default=DEFAULT_TEMPLATE,
+                        help='Prompt template to fill out for every method')
+    parser.add_argument('--stop-sonar', action='store_true',
+                        help='Stop the Sonarqube server after the analysis instead of keeping it up for the next run')
+    parser.add_argument('--no-analysis-cache', action='store_true',
+                        help='Run the static code analysis even if the current commit was already analyzed')
+    parser.add_argument('--skip-analysis', action='store_true',
+                        help='Do not run the static code analysis, prompts are sent without it')
+    parser.add_argument('--prompt-artifacts', choices=MODES, default='files',
+                        help='How the final prompts are saved: not at all, in one gzipped jsonl file, or one file per prompt')
+    parser.add_argument('--max-prompt-tokens', type=int, metavar='N',
+                        help='Prune the least useful context from prompts estimated to be over N tokens')
+    parser.add_argument('--pack-tokens', type=int, metavar='N',
+                        help='Send the methods of a file together in requests of up to an estimated N tokens, instead of one request per method')
+    parser.add_argument('--pack-methods', type=int, default=DEFAULT_MAX_METHODS,
+                        help='Maximum methods packed into one request')
+    parser.add_argument('--llm-combine', action='store_true',
+                        help='Ask the LLM to combine the tests of a file instead of merging them locally')
+    parser.add_argument('--validate', action='store_true',
+                        help='Compile the generated tests with javac and report the files that do not compile')
+    parser.add_argument('--quarantine', action='store_true',
+                        help='Validate the generated tests and rename the ones that do not compile so maven skips them')
+    parser.add_argument('--profile-prompts', metavar='REPORT',
+                        help='Write a json report of the estimated tokens of every prompt context field to REPORT')
+    parser.add_argument('--requests-per-minute', type=float, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help='Maximum requests sent to the LLM per minute, 0 for no limit')
+    parser.add_argument('--tokens-per-minute', type=float,
+                        help='Maximum estimated tokens sent to the LLM per minute')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help='Retries of a request that failed with a quota or availability error before giving up on it')
+    parser.add_argument('--backend', choices=BACKENDS, default='vertex',
+                        help='Where prompts are sent: Vertex AI, an offline stand-in, Vertex AI while recording the exchanges, or replaying a recording')
+    parser.add_argument('--recording', default=RECORDING_FILE,
+                        help='File the record backend appends to and the replay backend reads from')
+    parser.add_argument('--local-latency', type=float, default=DEFAULT_LOCAL_LATENCY,
+                        help='Average seconds the local backend takes to respond')
+    parser.add_argument('--trace', metavar='OUT',
+                        help='Write timing spans of every stage to OUT in the Chrome trace format')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if bool(args.repo_url) == bool(args.repos_file):
+        parser.error('give either a repo_url or a --repos-file')
+    if args.repos_file and args.module:
+        parser.error('--module can not be used with --repos-file, put the module next to the url instead')
+    return args
+
+
+class Session:
+    def __init__(self, args: argparse.Namespace) -> None:
+        """What every repository of a run shares: the caches, the LLM backend and its quota, the template and the profiler
+
+        Args:
+            args (argparse.Namespace): command line arguments
+        """
+        self.parse_cache = None if args.no_parse_cache else ParseCache()
+        self.cache = None if args.no_cache else ResponseCache()
+        llm.use_backend(create_backend(args.backend, llm.MODEL_NAME,
+                                       args.recording, args.local_latency))
+        # Repositories worked on at once send requests from their own pools, the client keeps them within --concurrency
+        self.client = LLMClient(args.requests_per_minute, args.tokens_per_minute, args.max_retries,
+                                max_in_flight=args.concurrency)
+        self.template = PromptTemplate(args.template)
+        self.profiler = PromptProfiler() if args.profile_prompts else None
 
 
 def run():
@@ -44,13 +141,99 @@ def run():
         logging.error("{} not a directory".format(e))
         return
 
-    repo_path = clone_or_update_repository(args.repo_url)
-    if args.module:
-        repo_path = repo_path/args.module
-    pre_processed_packages = preprocess(repo_path)
-    filled_out_prompts = fill_out_prompts(pre_processed_packages)
-    results = llm.generate_tests(filled_out_prompts)
-    postprocess(results)
+    if args.trace:
+        tracing.enable()
+    session = Session(args)
+    if args.repos_file:
+        run_batch(read_repos_file(args.repos_file),
+                  lambda repo_url, module: generate(
+                      args, session, repo_url, module, batch=True),
+                  args.parallel_repos, args.batch_summary)
+        if args.stop_sonar and not args.skip_analysis:
+            shutdown_sonarqube()
+    else:
+        generate(args, session, args.repo_url, args.module)
+    session.client.write_failure_report()
+    if session.profiler:
+        session.profiler.write(args.profile_prompts)
+    if args.trace:
+        tracing.write(args.trace)
+
+
+def generate(args: argparse.Namespace, session: Session, repo_url: str, module: str = None, batch: bool = False) -> dict:
+    """Generate the tests of one repository
+
+    Args:
+        args (argparse.Namespace): command line arguments
+        session (Session): what the repositories of the run share
+        repo_url (str): URL to the git repo
+        module (str): module to generate tests for, None for the whole repository
+        batch (bool): the repository is part of a batch, its prompts and compile errors are kept apart from the others
+
+    Returns:
+        dict: summary of the repository: its 'status', how many 'files' and 'tests' were generated, and the
+            'failed_prompts' and 'compile_failures' if there were any
+    """
+    with tracing.span('clone', repository=repo_url):
+        repo_root = clone_or_update_repository(repo_url, module,
+                                               history=bool(args.since or args.changed_only), full=args.full_clone,
+                                               mirror=not args.no_mirror)
+    repo_path = repo_root
+    if module:
+        repo_path = repo_root/module
+    # Request labels are relative to the target repository directory
+    label_directory = repo_path.absolute().relative_to(
+        Path(TARGET_DIRECTORY).absolute()).as_posix()
+    previous_failures = len(session.client.failures_for(label_directory))
+
+    changed_files = None
+    since = args.since
+    if args.changed_only:
+        since = last_generated_commit(repo_root, module)
+        if not since:
+            logging.info(
+                'No previous run recorded, generating tests for every file')
+    if since:
+        changed_files = find_changed_files(repo_root, since)
+        if not changed_files:
+            logging.info(f'No java files changed since {since}, nothing to do')
+            return {'status': 'unchanged', 'files': 0, 'tests': 0}
+
+    prompts_directory = PROMPTS_DIRECTORY
+    if batch:
+        prompts_directory = Path(PROMPTS_DIRECTORY, repo_root.name,
+                                 *(Path(module).parts if module else ()))
+    artifacts = PromptArtifactSink(args.prompt_artifacts, prompts_directory)
+    # Each stage streams into the next, so tests are written while later files are still being parsed
+    pre_processed_packages = buffered(iter_packages(
+        repo_path, changed_files, workers=args.workers, parse_cache=session.parse_cache,
+        stop_sonar=args.stop_sonar and not batch, analysis_cache=not args.no_analysis_cache,
+        static_analysis=not args.skip_analysis), maxsize=2, name='preprocess')
+    filled_out_prompts = buffered(iter_prompts(
+        pre_processed_packages, changed_files, session.template, artifacts, args.max_prompt_tokens, session.profiler), maxsize=args.concurrency * 4, name='prompts')
+    if args.pack_tokens:
+        filled_out_prompts = iter_packed(
+            filled_out_prompts, args.pack_tokens, args.pack_methods, llm.parameters['max_output_tokens'])
+    results = llm.iter_tests(
+        filled_out_prompts, concurrency=args.concurrency, cache=session.cache, client=session.client,
+        llm_combine=args.llm_combine)
+    with tracing.span('pipeline', repository=repo_url):
+        saved = postprocess(results)
+    summary = {'status': 'done', 'files': len(saved),
+               'tests': sum(count_tests(path.read_text()) for path in saved)}
+    if args.validate or args.quarantine:
+        failures = validate_tests(saved, quarantine_failures=args.quarantine,
+                                  report=None if batch else COMPILE_REPORT)
+        summary['compile_failures'] = failures
+    failed_prompts = session.client.failures_for(
+        label_directory)[previous_failures:]
+    if failed_prompts:
+        summary['failed_prompts'] = failed_prompts
+        logging.warning(
+            f'{len(failed_prompts)} prompt(s) of {label_directory} failed, not recording the commit so the next --changed-only run retries them')
+    else:
+        record_generated_commit(repo_root, module)
+    return summary
 
 
 def dir_path(string) -> Path:
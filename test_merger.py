@@ -0,0 +1,346 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from java_parser import tokenize, TYPE_KEYWORDS, ACCESS_MODIFIERS, MODIFIERS
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+CODE_BLOCK_PATTERN = re.compile(r'```(?:java)?(.*?)(?:```|$)', re.DOTALL)
+OPENING = '({['
+CLOSING = ')}]'
+LIFECYCLE_ANNOTATIONS = ('BeforeEach', 'AfterEach', 'BeforeAll', 'AfterAll',
+                         'Before', 'After', 'BeforeClass', 'AfterClass')
+
+
+class Member:
+    def __init__(self, code: str, tokens: list[tuple]) -> None:
+        """A field, method, nested type or initializer of a test class, with its comments and annotations
+
+        Args:
+            code (str): text of the snippet the member is in
+            tokens (list[tuple]): tokens of the member
+        """
+        self.code = code
+        self.tokens = tokens
+        self.annotations = []
+        self.kind = 'block'
+        self.name = None
+        self.name_index = None
+        self.parameters = ''
+        self.classify()
+
+    def classify(self):
+        code_tokens = [(i, token) for i, token in enumerate(self.tokens)
+                       if token[0] != 'comment']
+        position = 0
+        # Annotations and modifiers
+        while position < len(code_tokens):
+            _, (kind, text, _, _) = code_tokens[position]
+            if text == '@' and position + 1 < len(code_tokens):
+                self.annotations.append(code_tokens[position + 1][1][1])
+                position += 2
+                while position + 1 < len(code_tokens) and code_tokens[position][1][1] == '.':
+                    position += 2
+                if position < len(code_tokens) and code_tokens[position][1][1] == '(':
+                    position = self.skip_parens(code_tokens, position)
+            elif text in ACCESS_MODIFIERS or text in MODIFIERS:
+                position += 1
+            else:
+                break
+        rest = code_tokens[position:]
+        if not rest or rest[0][1][1] == '{':
+            return
+        if rest[0][1][1] in TYPE_KEYWORDS and len(rest) > 1:
+            self.kind = 'type'
+            self.name_index, self.name = rest[1][0], rest[1][1][1]
+            return
+        depth = 0
+        for position, (index, (kind, text, _, _)) in enumerate(rest):
+            if text == '<':
+                depth += 1
+            elif text == '>':
+                depth -= 1
+            elif depth == 0 and text in ('=', ';'):
+                break
+            elif depth == 0 and text == '(' and position > 0:
+                self.kind = 'method'
+                self.name_index, self.name = rest[position - 1][0], rest[position - 1][1][1]
+                end = self.skip_parens(rest, position)
+                self.parameters = ' '.join(token[1]
+                                           for _, token in rest[position:end])
+                return
+        self.kind = 'field'
+        words = [(index, token) for index, token in rest[:position]
+                 if token[0] == 'word']
+        if words:
+            self.name_index, self.name = words[-1][0], words[-1][1][1]
+
+    @staticmethod
+    def skip_parens(code_tokens: list, position: int) -> int:
+        depth = 0
+        while position < len(code_tokens):
+            text = code_tokens[position][1][1]
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+                if depth == 0:
+                    return position + 1
+            position += 1
+        return position
+
+    def normalized(self, with_name: bool = True) -> str:
+        """Text of the member without comments and formatting, to tell if two members are the same
+
+        Args:
+            with_name (bool): keep the name and access modifier of the member
+
+        Returns:
+            str: normalized text
+        """
+        return ' '.join(token[1] for i, token in enumerate(self.tokens)
+                        if token[0] != 'comment' and (with_name or (i != self.name_index and token[1] not in ACCESS_MODIFIERS)))
+
+    def is_lifecycle(self) -> bool:
+        return self.kind == 'method' and any(annotation in LIFECYCLE_ANNOTATIONS for annotation in self.annotations)
+
+    def text(self, renames: dict, field_renames: dict = None) -> str:
+        """Text of the member, with the methods it declares or calls, and the fields it declares or uses renamed
+
+        Args:
+            renames (dict): old method name to new name
+            field_renames (dict): old field name to new name
+
+        Returns:
+            str: source of the member
+        """
+        if not renames and not field_renames:
+            return self.code[self.tokens[0][2]:self.tokens[-1][3]]
+        field_renames = field_renames or {}
+        parts = []
+        last = self.tokens[0][2]
+        for i, (kind, text, start, end) in enumerate(self.tokens):
+            # Members of other objects, like calculator.add() or other.value, keep their name
+            own = i == 0 or self.tokens[i - 1][1] != '.' or (
+                i > 1 and self.tokens[i - 2][1] == 'this')
+            followed_by_call = i + 1 < len(
+                self.tokens) and self.tokens[i + 1][1] == '('
+            if kind != 'word':
+                continue
+            if text in renames and ((followed_by_call and own) or i == self.name_index):
+                parts.append(self.code[last:start])
+                parts.append(renames[text])
+                last = end
+            elif text in field_renames and own and not followed_by_call:
+                parts.append(self.code[last:start])
+                parts.append(field_renames[text])
+                last = end
+        parts.append(self.code[last:self.tokens[-1][3]])
+        return ''.join(parts)
+
+
+class TestSnippet:
+    def __init__(self, code: str) -> None:
+        """A test class generated by the LLM, split into its parts
+
+        Args:
+            code (str): source of the test class
+
+        Raises:
+            ValueError: if there is no class in the code
+        """
+        self.code = code
+        self.package = None
+        self.imports = []
+        self.declaration = None
+        self.members = []
+        self.parse(tokenize(code))
+
+    def parse(self, tokens: list[tuple]):
+        position = 0
+        declaration_start = None
+        while position < len(tokens):
+            kind, text, start, _ = tokens[position]
+            if kind == 'comment':
+                position += 1
+                continue
+            if text in ('package', 'import') and declaration_start is None:
+                end = position
+                while end < len(tokens) and tokens[end][1] != ';':
+                    end += 1
+                statement = self.code[start:tokens[min(
+                    end, len(tokens) - 1)][3]]
+                if text == 'package':
+                    self.package = statement
+                else:
+                    self.imports.append(' '.join(statement.split()))
+                position = end + 1
+                continue
+            if declaration_start is None:
+                declaration_start = start
+            if text in TYPE_KEYWORDS:
+                break
+            position += 1
+        else:
+            raise ValueError('No test class found')
+
+        body_start = position
+        while body_start < len(tokens) and tokens[body_start][1] != '{':
+            body_start += 1
+        if body_start == len(tokens):
+            raise ValueError('Test class has no body')
+        self.declaration = self.code[declaration_start:tokens[body_start][2]].strip()
+
+        depth = 0
+        member = []
+        assigned = False
+        for token in tokens[body_start + 1:]:
+            kind, text, _, _ = token
+            if kind == 'symbol' and text in CLOSING:
+                depth -= 1
+                if depth < 0:
+                    break
+            member.append(token)
+            if kind != 'symbol':
+                continue
+            if text in OPENING:
+                depth += 1
+            elif depth == 0 and text == '=':
+                assigned = True
+            elif depth == 0 and (text == ';' or (text == '}' and not assigned)):
+                self.members.append(Member(self.code, member))
+                member = []
+                assigned = False
+        # Unterminated members at the end of a truncated response are dropped
+        if any(token[0] != 'comment' for token in member):
+            logging.info(
+                'Dropping an incomplete member at the end of a generated test')
+
+
+def extract_code(text: str) -> str:
+    """Take the java code out of a response, which may or may not be in a fenced code block
+
+    Args:
+        text (str): response from the LLM
+
+    Returns:
+        str: the code
+    """
+    if '```' not in text:
+        return text
+    blocks = CODE_BLOCK_PATTERN.findall(text)
+    return max(blocks, key=len) if blocks else text
+
+
+def merge_tests(results: list[str], name: str) -> str:
+    """Merge the generated test classes of a source file into 1 test class, without asking the LLM.
+    Imports are unioned, duplicate fields, setup methods and tests are dropped, and clashing method names are renamed
+
+    Args:
+        results (list[str]): generated tests
+        name (str): name of the merged test class
+
+    Returns:
+        str: source of the merged test class, or the first result if none of them could be parsed
+    """
+    snippets = []
+    for result in results:
+        try:
+            snippets.append(TestSnippet(extract_code(result)))
+        except ValueError as e:
+            logging.warning(f'Could not merge a generated test of {name}: {e}')
+    if not snippets:
+        return results[0]
+
+    package = next(
+        (snippet.package for snippet in snippets if snippet.package), None)
+    imports = list(dict.fromkeys(
+        statement for snippet in snippets for statement in snippet.imports))
+    imports.sort(key=lambda statement: statement.startswith('import static'))
+
+    fields = {}
+    methods = {}
+    lifecycle = set()
+    blocks = set()
+    members = []
+    for snippet in snippets:
+        renames = {}
+        field_renames = {}
+        declaration_renames = {}
+        kept = []
+        for member in snippet.members:
+            if member.kind == 'field':
+                normalized = member.normalized(with_name=False)
+                if fields.get(member.name) == normalized:
+                    continue
+                if member.name in fields:
+                    # Same name, different type or initializer: both are kept, this snippet uses its own under a new name
+                    new_name = f'{member.name}2'
+                    while new_name in fields:
+                        new_name += '_'
+                    logging.info(
+                        f'Renaming the field {member.name} of a generated test of {name} to {new_name}, it clashes with another one')
+                    field_renames[member.name] = new_name
+                    fields[new_name] = normalized
+                else:
+                    fields[member.name] = normalized
+            elif member.kind == 'block':
+                if member.normalized() in blocks:
+                    continue
+                blocks.add(member.normalized())
+            else:
+                if member.is_lifecycle():
+                    setup = (tuple(member.annotations),
+                             member.normalized(with_name=False))
+                    if setup in lifecycle:
+                        continue
+                    lifecycle.add(setup)
+                key = (member.kind, member.name, member.parameters)
+                existing = methods.setdefault(key, [])
+                if member.normalized() in existing:
+                    continue
+                if existing:
+                    new_name = f'{member.name}{len(existing) + 1}'
+                    while (member.kind, new_name, member.parameters) in methods:
+                        new_name += '_'
+                    if 'Test' in member.annotations:
+                        # Nothing calls a test, only its declaration is renamed
+                        declaration_renames[id(member)] = new_name
+                    else:
+                        renames[member.name] = new_name
+                    methods[(member.kind, new_name,
+                             member.parameters)] = [member.normalized()]
+                existing.append(member.normalized())
+            kept.append(member)
+        members.extend(member.text(dict(renames, **{member.name: declaration_renames[id(member)]})
+                                   if id(member) in declaration_renames else renames, field_renames) for member in kept)
+
+    declaration = re.sub(r'\b(class|record)\s+[\w$]+',
+                         rf'\1 {name}', snippets[0].declaration, count=1)
+    lines = []
+    if package:
+        lines.append(package)
+        lines.append('')
+    lines.extend(imports)
+    if imports:
+        lines.append('')
+    lines.append(declaration + ' {')
+    for member in members:
+        lines.append('')
+        lines.append('    ' + member)
+    lines.append('}')
+    lines.append('')
+    return '\n'.join(lines)
@@ -0,0 +1,66 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pathlib import Path
+import subprocess
+import sys
+from prompt_template import DEFAULT_TEMPLATE
+import test_generator
+
+SOURCE = '''package com.example;
+
+public class Counter {
+    private int count;
+
+    public int next() {
+        return ++count;
+    }
+}
+'''
+
+
+def git(directory, *arguments):
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *arguments],
+                   cwd=directory, check=True, capture_output=True)
+
+
+def make_remote(directory):
+    source_directory = directory / 'src' / 'main' / 'java' / 'com' / 'example'
+    source_directory.mkdir(parents=True)
+    source_directory.joinpath('Counter.java').write_text(SOURCE)
+    git(directory, 'init', '-q')
+    git(directory, 'add', '.')
+    git(directory, 'commit', '-q', '-m', 'Add counter')
+    return directory.absolute().as_uri()
+
+
+def test_second_changed_only_run_has_nothing_to_do(tmp_path, monkeypatch):
+    repo_url = make_remote(tmp_path / 'remote')
+    # Everything the run writes stays in the temporary directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['test_generator.py', repo_url, '--changed-only', '--no-mirror',
+                                      '--backend', 'local', '--local-latency', '0', '--skip-analysis',
+                                      '--no-cache', '--no-parse-cache', '--prompt-artifacts', 'off',
+                                      '--template', str(Path(test_generator.__file__).parent / DEFAULT_TEMPLATE)])
+    args = test_generator.setup()
+    session = test_generator.Session(args)
+
+    first = test_generator.generate(args, session, repo_url)
+    assert first['status'] == 'done'
+    assert first['files'] == 1
+    assert list(tmp_path.glob('target_repository/remote/src/test/**/*GenTest.java'))
+
+    # The generated tests are untracked files in the clone, they are not changes to generate tests for
+    second = test_generator.generate(args, session, repo_url)
+    assert second == {'status': 'unchanged', 'files': 0, 'tests': 0}
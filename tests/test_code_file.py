@@ -0,0 +1,72 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pathlib import Path
+from code_file import CodeFile
+from java_parser import parse_java
+
+SOURCE = '''package com.example;
+
+class Counter {
+    @Override
+    public String toString() {
+        return "counter";
+    }
+
+    int next(int value) {
+        return value + 1;
+    }
+}
+'''
+
+
+def code_file(issue_lines):
+    parsed = parse_java(SOURCE)
+    issues = sorted(({'line': line, 'message': f'issue at {line}'} for line in issue_lines),
+                    key=lambda issue: issue['line'] or 0)
+    return CodeFile(parsed['class_signatures'], parsed['class_comments'], parsed['fields'], parsed['methods'],
+                    Path('Counter.java'), parsed['package'], parsed['imports'], issues)
+
+
+def messages(issue_lines):
+    file = code_file(issue_lines)
+    return {method.signature.name: file.issues_for(method) for method in file.methods}
+
+
+def test_method_lines():
+    # The annotation is part of the declaration
+    assert [(method.start_line, method.end_line) for method in code_file([]).methods] == [(4, 7), (9, 11)]
+
+
+def test_issue_on_the_first_line_of_a_method():
+    assert messages([4, 9]) == {'toString': ['issue at 4'], 'next': ['issue at 9']}
+
+
+def test_issue_on_the_last_line_of_a_method():
+    assert messages([7, 11]) == {'toString': ['issue at 7'], 'next': ['issue at 11']}
+
+
+def test_issue_between_methods_belongs_to_neither():
+    assert messages([3, 8, 12]) == {'toString': [], 'next': []}
+
+
+def test_file_level_issue_belongs_to_no_method():
+    assert messages([None, 5]) == {'toString': ['issue at 5'], 'next': []}
+
+
+def test_method_without_lines_gets_every_issue():
+    file = code_file([None, 5, 10])
+    method = file.methods[0]
+    method.start_line = None
+    assert file.issues_for(method) == ['issue at None', 'issue at 5', 'issue at 10']
@@ -0,0 +1,86 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from pathlib import Path
+import subprocess
+import compile_check
+
+SYNTAX_ERROR = '''class BrokenGenTest {
+    void test() { int x = 1 }
+}
+'''
+TYPE_ERROR = '''class WrongGenTest {
+    void test() { Missing value = null; }
+}
+'''
+VALID = '''class GoodGenTest {
+    void test() {}
+}
+'''
+
+
+def fake_javac(calls):
+    """Stands in for javac: a syntax error in any file ends the compilation before the types are checked"""
+    def run(command, cwd, capture_output, text):
+        # The sources are in the argument file, the last argument
+        sources = [line.strip('"') for line in Path(command[-1][1:]).read_text().splitlines()]
+        calls.append(sources)
+        syntax_errors = [f'{source}:2: error: \';\' expected' for source in sources
+                         if 'int x = 1 }' in Path(source).read_text()]
+        type_errors = [f'{source}:2: error: cannot find symbol' for source in sources
+                       if 'Missing' in Path(source).read_text()]
+        errors = syntax_errors or type_errors
+        return subprocess.CompletedProcess(command, 1 if errors else 0, '', '\n'.join(errors))
+    return run
+
+
+def write_tests(tmp_path):
+    (tmp_path / 'pom.xml').write_text('<project/>')
+    directory = tmp_path / 'src' / 'test' / 'java'
+    directory.mkdir(parents=True)
+    files = []
+    for name, code in (('BrokenGenTest', SYNTAX_ERROR), ('WrongGenTest', TYPE_ERROR), ('GoodGenTest', VALID)):
+        files.append(directory / f'{name}.java')
+        files[-1].write_text(code)
+    return files
+
+
+def test_type_errors_are_found_after_syntax_errors(tmp_path, monkeypatch):
+    broken, wrong, good = write_tests(tmp_path)
+    calls = []
+    monkeypatch.setattr(compile_check.subprocess, 'run', fake_javac(calls))
+
+    failures = compile_check.compile_module(tmp_path, [broken, wrong, good], 'classes')
+
+    assert sorted(failures) == sorted([str(broken), str(wrong)])
+    assert failures[str(broken)][0]['message'] == "';' expected"
+    assert failures[str(wrong)][0]['message'] == 'cannot find symbol'
+    # The failing files are left out of the next pass, which ends once it is clean
+    assert calls == [[str(broken), str(wrong), str(good)], [str(wrong), str(good)], [str(good)]]
+
+
+def test_all_failing_files_are_quarantined(tmp_path, monkeypatch):
+    broken, wrong, good = write_tests(tmp_path)
+    monkeypatch.setattr(compile_check.subprocess, 'run', fake_javac([]))
+    monkeypatch.setattr(compile_check, 'resolve_classpath', lambda module_root: 'classes')
+    report = tmp_path / 'compile_report.json'
+
+    failures = compile_check.validate_tests([broken, wrong, good], quarantine_failures=True, report=report)
+
+    assert sorted(failures) == sorted([str(broken), str(wrong)])
+    assert json.loads(report.read_text()) == failures
+    assert not broken.exists() and not wrong.exists() and good.exists()
+    assert broken.with_name(broken.name + compile_check.QUARANTINE_SUFFIX).exists()
+    assert wrong.with_name(wrong.name + compile_check.QUARANTINE_SUFFIX).exists()
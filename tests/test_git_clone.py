@@ -0,0 +1,85 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import pytest
+from git import Repo
+import git_clone
+
+
+def git(directory, *arguments):
+    return subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *arguments],
+                          cwd=directory, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def make_remote(directory):
+    """Repository with 2 modules and 2 commits"""
+    for module in ('a', 'b'):
+        source_directory = directory / 'svc' / module / 'src' / 'main' / 'java'
+        source_directory.mkdir(parents=True)
+        source_directory.joinpath(f'{module.upper()}.java').write_text(f'class {module.upper()} {{}}\n')
+    git(directory, 'init', '-q')
+    # Sparse clones of a module download blobs on demand
+    git(directory, 'config', 'uploadpack.allowFilter', 'true')
+    git(directory, 'add', '.')
+    git(directory, 'commit', '-q', '-m', 'Add modules')
+    first = git(directory, 'rev-parse', 'HEAD')
+    directory.joinpath('svc', 'a', 'src', 'main', 'java', 'A.java').write_text('class A { void run() {} }\n')
+    git(directory, 'commit', '-q', '-am', 'Change a')
+    return directory.absolute().as_uri(), first
+
+
+def is_shallow(repo):
+    return os.path.isfile(os.path.join(repo.git_dir, 'shallow'))
+
+
+def test_full_clone_of_an_existing_shallow_sparse_clone(tmp_path, monkeypatch):
+    repo_url, _ = make_remote(tmp_path / 'remote')
+    monkeypatch.chdir(tmp_path)
+    path = git_clone.clone_or_update_repository(repo_url, 'svc/a', mirror=False)
+    repo = Repo(path)
+    assert is_shallow(repo) and git_clone.is_sparse(repo)
+    assert not path.joinpath('svc', 'b').exists()
+
+    git_clone.clone_or_update_repository(repo_url, full=True, mirror=False)
+
+    assert not is_shallow(repo) and not git_clone.is_sparse(repo)
+    assert path.joinpath('svc', 'b', 'src', 'main', 'java', 'B.java').is_file()
+    assert len(list(repo.iter_commits())) == 2
+
+
+def test_missing_base_commit_is_an_error(tmp_path, monkeypatch):
+    repo_url, first = make_remote(tmp_path / 'remote')
+    monkeypatch.chdir(tmp_path)
+    # A shallow clone only has the last commit
+    path = git_clone.clone_or_update_repository(repo_url, mirror=False)
+
+    with pytest.raises(SystemExit):
+        git_clone.find_changed_files(path, first)
+
+
+def test_changed_files_are_main_sources(tmp_path, monkeypatch):
+    repo_url, first = make_remote(tmp_path / 'remote')
+    monkeypatch.chdir(tmp_path)
+    path = git_clone.clone_or_update_repository(repo_url, history=True, mirror=False)
+    test_directory = path.joinpath('svc', 'b', 'src', 'test', 'java')
+    test_directory.mkdir(parents=True)
+    test_directory.joinpath('BGenTest.java').write_text('class BGenTest {}\n')
+    test_directory.joinpath('BGenTest.java.quarantined').write_text('class BGenTest {\n')
+    path.joinpath('svc', 'b', 'src', 'main', 'java', 'C.java').write_text('class C {}\n')
+
+    assert git_clone.find_changed_files(path, first) == {
+        str(path.joinpath('svc', 'a', 'src', 'main', 'java', 'A.java').absolute()),
+        str(path.joinpath('svc', 'b', 'src', 'main', 'java', 'C.java').absolute())}
@@ -0,0 +1,100 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from java_parser import tokenize, parse_java
+
+
+def test_braces_in_strings_comments_and_chars_are_not_symbols():
+    tokens = tokenize('String s = "}{"; // }\nchar c = \'{\'; /* { */ int i;')
+    assert [text for kind, text, _, _ in tokens if kind == 'symbol' and text in '{}'] == []
+    assert ('string', '"}{"') in [(kind, text) for kind, text, _, _ in tokens]
+
+
+def test_unterminated_comment_and_string_do_not_raise():
+    assert tokenize('int a; /* never closed')[-1][0] == 'comment'
+    assert tokenize('String s = "never closed')[-1][0] == 'string'
+
+
+def test_generic_class_signature_and_method():
+    parsed = parse_java('''package a.b;
+import java.util.*;
+public class Box<T extends Comparable<T>> implements Store<Map<String, List<T>>>, Runnable {
+    private Map<String, List<T>> items = new HashMap<>();
+    public <K> Map<K, List<T>> get(K key, Map<K, ? extends T> values) throws IOException {
+        return null;
+    }
+}
+''')
+    signature = parsed['class_signatures'][0]
+    assert signature['name'] == 'Box'
+    assert signature['implements'] == ['Store<Map<String, List<T>>>', 'Runnable']
+    assert parsed['fields'] == ['private Map<String, List<T>> items = new HashMap<>();']
+    method = parsed['methods'][0]
+    assert method.signature.name == 'get'
+    assert method.signature.ret_val == 'Map<K, List<T>>'
+    assert method.signature.parameters == ['K key', 'Map<K, ? extends T> values']
+
+
+def test_braces_in_method_bodies_do_not_end_the_method():
+    parsed = parse_java('''class A {
+    String open() { return "{{"; }
+    char close() { if (true) { return '}'; } return ' '; }
+    int after() { return 1; }
+}
+''')
+    assert [method.signature.name for method in parsed['methods']] == ['open', 'close', 'after']
+    assert parsed['methods'][1].body.endswith("return ' '; }")
+
+
+def test_enum_constants_with_bodies():
+    parsed = parse_java('''public enum Operation {
+    PLUS("+") {
+        int apply(int a, int b) { return a + b; }
+    },
+    MINUS("-");
+
+    private final String symbol;
+
+    Operation(String symbol) { this.symbol = symbol; }
+
+    int apply(int a, int b) { return 0; }
+}
+''')
+    assert parsed['class_signatures'][0]['type'] == 'enum'
+    assert 'private final String symbol;' in parsed['fields']
+    # Methods in the body of a constant belong to an anonymous class, only the enum's own are listed
+    names = [method.signature.name for method in parsed['methods']]
+    assert names.count('apply') == 1
+    assert any(method.is_constructor for method in parsed['methods'])
+
+
+def test_nested_class_methods_are_found():
+    parsed = parse_java('''class Outer {
+    static class Inner {
+        void inner() {}
+    }
+    void outer() {}
+}
+''')
+    assert [signature['name'] for signature in parsed['class_signatures']] == ['Outer', 'Inner']
+    assert sorted(method.signature.name for method in parsed['methods']) == ['inner', 'outer']
+
+
+def test_empty_entries_in_a_type_list_are_skipped():
+    parsed = parse_java('''class Broken implements A,,B {
+    void run() {}
+}
+''')
+    assert parsed['class_signatures'][0]['implements'] == ['A', 'B']
+    assert [method.signature.name for method in parsed['methods']] == ['run']
@@ -0,0 +1,160 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from google.api_core import exceptions
+import pytest
+import llm_client
+from llm_client import CircuitBreaker, LLMClient, TokenBucket
+
+
+class FakeClock:
+    """Stands in for the time module, sleeping only moves the clock forward"""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class LongestDelay:
+    """Stands in for the random module, the jitter always picks the longest delay"""
+
+    def uniform(self, low: float, high: float) -> float:
+        return high
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_client, 'time', clock)
+    monkeypatch.setattr(llm_client, 'random', LongestDelay())
+    return clock
+
+
+def responses(*outcomes):
+    """A send that raises or returns each of the outcomes in turn"""
+    remaining = list(outcomes)
+
+    def send():
+        outcome = remaining.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    send.remaining = remaining
+    return send
+
+
+def test_token_bucket_allows_a_burst_then_waits_for_the_refill(clock):
+    bucket = TokenBucket(60)
+    for _ in range(60):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(1)]
+
+
+def test_token_bucket_caps_an_amount_at_its_capacity(clock):
+    bucket = TokenBucket(60)
+    bucket.acquire(1000)
+    assert clock.sleeps == []
+    bucket.acquire(30)
+    assert clock.sleeps == [pytest.approx(30)]
+
+
+def test_circuit_breaker_opens_at_the_threshold_and_closes_after_the_cooldown(clock):
+    breaker = CircuitBreaker(window=4, threshold=0.5, min_calls=4, cooldown=30)
+    for success in (True, False, True):
+        breaker.record(success)
+    breaker.wait()
+    assert clock.sleeps == []
+
+    breaker.record(False)
+    breaker.wait()
+    assert clock.sleeps == [30]
+    # Closed again, and the failures before it opened are forgotten
+    breaker.record(False)
+    breaker.wait()
+    assert clock.sleeps == [30]
+
+
+def test_retryable_errors_are_retried_with_backoff(clock):
+    client = LLMClient(requests_per_minute=None, max_retries=3)
+    send = responses(exceptions.ServiceUnavailable('down'), exceptions.TooManyRequests('slow down'), 'tests')
+
+    assert client.call(send, 100, 'repo/src/A.java') == 'tests'
+    assert clock.sleeps == [1, 2]
+    assert client.failures == []
+
+
+def test_requests_are_given_up_on_after_max_retries(clock):
+    client = LLMClient(requests_per_minute=None, max_retries=2)
+    send = responses(*[exceptions.ResourceExhausted('quota')] * 4)
+
+    with pytest.raises(exceptions.ResourceExhausted):
+        client.call(send, 100, 'repo/src/A.java')
+    assert clock.sleeps == [1, 2]
+    assert len(send.remaining) == 1
+    assert client.failures == [{'prompt': 'repo/src/A.java', 'error': 'ResourceExhausted',
+                                'message': '429 quota', 'attempts': 3}]
+
+
+def test_other_errors_are_not_retried(clock):
+    client = LLMClient(requests_per_minute=None)
+
+    with pytest.raises(ValueError):
+        client.call(responses(ValueError('bad request'), 'tests'), 100, 'repo/src/A.java')
+    assert clock.sleeps == []
+    assert client.failures[0]['attempts'] == 1
+
+
+def test_retries_wait_for_an_open_circuit(clock):
+    breaker = CircuitBreaker(window=2, threshold=0.5, min_calls=2, cooldown=30)
+    client = LLMClient(requests_per_minute=None, max_retries=3, breaker=breaker)
+    send = responses(TimeoutError(), ConnectionError(), 'tests')
+
+    assert client.call(send, 100, 'repo/src/A.java') == 'tests'
+    # The backoff of the second retry counts toward the cooldown of the circuit it opened
+    assert clock.sleeps == [1, 2, 28]
+
+
+def test_failures_are_found_by_directory(clock):
+    client = LLMClient(requests_per_minute=None, max_retries=0)
+    for label in ('repo/a/src/A.java', 'repo/ab/src/B.java', 'repo/a/src/C.java#combine'):
+        with pytest.raises(TimeoutError):
+            client.call(responses(TimeoutError()), 100, label)
+
+    assert [failure['prompt'] for failure in client.failures_for('repo/a')] == \
+        ['repo/a/src/A.java', 'repo/a/src/C.java#combine']
+    assert client.failures_for('repo/a/') == client.failures_for('repo/a')
+    assert len(client.failures_for('repo')) == 3
+
+
+def test_failure_report_of_an_earlier_run_is_removed(clock, tmp_path):
+    report = tmp_path / 'failed_prompts.json'
+    client = LLMClient(requests_per_minute=None, max_retries=0)
+    with pytest.raises(TimeoutError):
+        client.call(responses(TimeoutError('timed out')), 100, 'repo/src/A.java')
+    client.write_failure_report(report)
+    assert json.loads(report.read_text()) == client.failures
+
+    LLMClient(requests_per_minute=None).write_failure_report(report)
+    assert not report.exists()
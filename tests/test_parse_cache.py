@@ -0,0 +1,84 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from java_parser import parse_java
+from parse_cache import ParseCache, deserialize, hash_content, serialize
+
+SOURCE = '''package com.example;
+
+/** A class with a nested class */
+public class Outer<T> implements Runnable {
+    private int count;
+
+    public Outer(int count) throws IllegalArgumentException {
+        this.count = count;
+    }
+
+    public void run() {}
+
+    static class Inner {
+        protected static String name(String prefix, int index) { return prefix + index; }
+    }
+}
+'''
+
+
+def method_values(method):
+    signature = method.signature
+    return (signature.access, signature.modifiers, signature.ret_val, signature.name, signature.parameters,
+            signature.exceptions, method.body, method.comment, method.is_constructor,
+            method.start, method.end, method.start_line, method.end_line)
+
+
+def assert_same_parse(actual, expected):
+    assert {key: value for key, value in actual.items() if key != 'methods'} == \
+        {key: value for key, value in expected.items() if key != 'methods'}
+    assert [method_values(method) for method in actual['methods']] == \
+        [method_values(method) for method in expected['methods']]
+    # Methods still point at their own class signature
+    for actual_method, expected_method in zip(actual['methods'], expected['methods']):
+        assert actual_method.parent_class == expected_method.parent_class
+
+
+def test_serialize_deserialize_round_trip():
+    parsed = parse_java(SOURCE)
+    assert len(parsed['methods']) == 3
+
+    assert_same_parse(deserialize(serialize(parsed)), parsed)
+
+
+def test_store_and_load_round_trip(tmp_path):
+    file = tmp_path / 'Outer.java'
+    file.write_text(SOURCE)
+    cache = ParseCache(tmp_path / 'cache')
+    parsed = parse_java(SOURCE)
+    cache.store(file, hash_content(SOURCE), parsed, file.stat())
+
+    content_hash, loaded = ParseCache(tmp_path / 'cache').load(file)
+    assert content_hash == hash_content(SOURCE)
+    assert_same_parse(loaded, parsed)
+
+
+def test_file_written_after_the_stat_is_a_miss(tmp_path):
+    file = tmp_path / 'Outer.java'
+    file.write_text(SOURCE)
+    stat = file.stat()
+    cache = ParseCache(tmp_path / 'cache')
+    cache.store(file, hash_content(SOURCE), parse_java(SOURCE), stat)
+    # Written while the old contents were being parsed
+    file.write_text(SOURCE.replace('run()', 'stop()'))
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert cache.load(file)[1] is None
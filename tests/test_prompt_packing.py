@@ -0,0 +1,101 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from context_budget import estimate_tokens, json_tokens
+from prompt_packing import PACK_INSTRUCTIONS, PACKED_KEY, pack_prompts, split_response, split_target
+
+QUESTION = 'Write tests for the target method'
+
+
+def prompt(name, issues=None, class_name='Counter'):
+    return {'question': QUESTION,
+            'context': {'test_name': f'{class_name}GenTest',
+                        'source_code': {'target_method_comment': '',
+                                        'target_method_signature': f'void {name}()',
+                                        'target_method_body': f'{{ {name}(); }}',
+                                        'class_name': class_name},
+                        'static_code_analysis': issues or []}}
+
+
+def test_methods_of_a_class_are_packed_with_their_own_issues():
+    packed = pack_prompts([prompt('a', ['issue in a']), prompt('b')], budget=10000)
+
+    assert len(packed) == 1
+    assert packed[0]['methods'] == 2
+    assert packed[0]['question'].startswith(QUESTION)
+    context = packed[0]['context']
+    # The method's issues go with it, the rest of the context is sent once
+    assert 'static_code_analysis' not in context
+    targets = context['source_code'][PACKED_KEY]
+    assert [target['target_method_signature'] for target in targets] == ['void a()', 'void b()']
+    assert [target['static_code_analysis'] for target in targets] == [['issue in a'], []]
+    assert 'target_method_body' not in context['source_code']
+    assert context['source_code']['class_name'] == 'Counter'
+
+
+def test_packing_does_not_change_the_prompts():
+    prompts = [prompt('a'), prompt('b')]
+    pack_prompts(prompts, budget=10000)
+    assert prompts == [prompt('a'), prompt('b')]
+
+
+def test_prompts_with_different_contexts_are_not_packed():
+    prompts = [prompt('a'), prompt('b', class_name='Other')]
+    assert pack_prompts(prompts, budget=10000) == prompts
+
+
+def test_max_methods_limits_a_pack():
+    packed = pack_prompts([prompt(name) for name in 'abcde'], budget=10000, max_methods=2)
+    assert [request.get('methods', 1) for request in packed] == [2, 2, 1]
+
+
+def test_budget_limits_a_pack():
+    prompts = [prompt(name) for name in 'abcd']
+    shared, target = split_target(prompts[0]['context'])
+    # Just enough for the shared context and two target methods
+    budget = estimate_tokens(QUESTION + PACK_INSTRUCTIONS) + json_tokens(shared) + 2 * json_tokens(target)
+    packed = pack_prompts(prompts, budget=budget)
+    assert [request.get('methods', 1) for request in packed] == [2, 2]
+
+
+def test_prompts_without_a_target_method_are_kept():
+    other = {'question': QUESTION, 'context': {'test_name': 'CounterGenTest'}}
+    packed = pack_prompts([prompt('a'), other, prompt('b')], budget=10000)
+    assert packed == [prompt('a'), other, prompt('b')]
+
+
+def test_single_method_response_is_not_split():
+    text = 'Here you go\n```java\nclass ATest {}\n```'
+    assert split_response(text, 1) == [text]
+
+
+def test_response_is_split_by_code_block():
+    text = ('```java\n// TARGET METHOD 1\nclass ATest {}\n```\ntext in between\n'
+            '```java\n// TARGET METHOD 2\nclass BTest {}\n```')
+    assert split_response(text, 2) == ['```java\nclass ATest {}\n```', '```java\nclass BTest {}\n```']
+
+
+def test_response_is_split_by_marker():
+    text = '```java\n// TARGET METHOD 1\nclass ATest {}\n// TARGET METHOD 2\nclass BTest {}\n```'
+    assert split_response(text, 2) == ['```java\nclass ATest {}\n```', '```java\nclass BTest {}\n```']
+
+
+def test_code_blocks_are_kept_when_the_response_can_not_be_split():
+    text = '```java\n// TARGET METHOD 1\nclass ATest {}\n```\n```java\nclass BTest {}\n```'
+    assert split_response(text, 3) == ['```java\nclass ATest {}\n```', '```java\nclass BTest {}\n```']
+
+
+def test_response_without_code_blocks_is_kept_whole():
+    text = 'Sorry, I can not write these tests'
+    assert split_response(text, 2) == [text]
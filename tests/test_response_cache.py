@@ -0,0 +1,89 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from response_cache import ResponseCache, cache_key
+
+PARAMETERS = {'temperature': 0.2, 'max_output_tokens': 1024}
+
+
+def put(cache, question, text):
+    cache.put('context', question, 'model', PARAMETERS, text)
+
+
+def get(cache, question):
+    return cache.get('context', question, 'model', PARAMETERS)
+
+
+def entry_path(cache, question):
+    return cache._entry_path(cache_key('context', question, 'model', PARAMETERS))
+
+
+def set_times(cache, question, accessed=None, modified=None):
+    path = entry_path(cache, question)
+    stat = path.stat()
+    os.utime(path, (accessed or stat.st_atime, modified or stat.st_mtime))
+
+
+def test_cache_key_is_stable():
+    key = cache_key('context', 'question', 'model', PARAMETERS)
+    assert key == cache_key('context', 'question', 'model',
+                            dict(reversed(list(PARAMETERS.items()))))
+    assert key != cache_key('context', 'question', 'model',
+                            dict(PARAMETERS, temperature=0.3))
+    assert key != cache_key('context', 'other question', 'model', PARAMETERS)
+
+
+def test_responses_are_found_by_a_new_cache(tmp_path):
+    put(ResponseCache(tmp_path), 'question', 'response')
+
+    cache = ResponseCache(tmp_path)
+    assert get(cache, 'question') == 'response'
+    assert get(cache, 'other question') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.size == len('response')
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(tmp_path, max_size=250)
+    put(cache, 'a', 'a' * 100)
+    put(cache, 'b', 'b' * 100)
+    now = time.time()
+    set_times(cache, 'a', accessed=now - 20)
+    set_times(cache, 'b', accessed=now - 10)
+    # Using a makes b the least recently used
+    assert get(cache, 'a') == 'a' * 100
+
+    put(cache, 'c', 'c' * 100)
+
+    assert get(cache, 'b') is None
+    assert get(cache, 'a') == 'a' * 100
+    assert get(cache, 'c') == 'c' * 100
+    assert cache.size == 200
+
+
+def test_entries_older_than_the_max_age_are_removed(tmp_path):
+    cache = ResponseCache(tmp_path, max_age=100)
+    put(cache, 'old', 'old response')
+    put(cache, 'new', 'new response')
+    set_times(cache, 'old', modified=time.time() - 200)
+
+    assert get(cache, 'old') is None
+    assert not entry_path(cache, 'old').exists()
+    assert cache.size == len('new response')
+    # Opening the cache removes old entries too
+    set_times(cache, 'new', modified=time.time() - 200)
+    assert ResponseCache(tmp_path, max_age=100).size == 0
+    assert not entry_path(cache, 'new').exists()
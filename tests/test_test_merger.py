@@ -0,0 +1,111 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import test_merger
+from test_merger import merge_tests
+
+
+def snippet(name: str, body: str, imports: str = 'import org.junit.jupiter.api.Test;') -> str:
+    return f'```java\npackage com.acme;\n\n{imports}\n\nclass {name} {{\n{body}\n}}\n```'
+
+
+def members(code: str) -> list:
+    return test_merger.TestSnippet(code).members
+
+
+def test_imports_are_unioned_and_static_imports_come_last():
+    merged = merge_tests([
+        snippet('ATest', '@Test void a() {}',
+                'import static org.junit.jupiter.api.Assertions.*;\nimport org.junit.jupiter.api.Test;'),
+        snippet('BTest', '@Test void b() {}', 'import org.junit.jupiter.api.Test;\nimport java.util.List;')],
+        'CalcGenTest')
+    assert merged.count('import org.junit.jupiter.api.Test;') == 1
+    assert merged.index('import java.util.List;') < merged.index('import static')
+    assert 'class CalcGenTest {' in merged
+    assert merged.startswith('package com.acme;')
+
+
+def test_clashing_tests_are_renamed_and_identical_ones_dropped():
+    merged = merge_tests([
+        snippet('ATest', '@Test void testAdd() { assertEquals(2, add(1, 1)); }'),
+        snippet('BTest', '@Test void testAdd() { assertEquals(3, add(1, 2)); }'),
+        snippet('CTest', '@Test void testAdd() { assertEquals(2, add(1, 1)); }')],
+        'CalcGenTest')
+    assert merged.count('void testAdd()') == 1
+    assert merged.count('void testAdd2()') == 1
+    assert 'testAdd3' not in merged
+
+
+def test_clashing_helpers_are_renamed_with_their_calls():
+    merged = merge_tests([
+        snippet('ATest', 'private int value() { return 1; }\n@Test void a() { assertEquals(1, value()); }'),
+        snippet('BTest', 'private int value() { return 2; }\n@Test void b() { assertEquals(2, this.value()); other.value(); }')],
+        'CalcGenTest')
+    assert 'private int value() { return 1; }' in merged
+    assert 'private int value2() { return 2; }' in merged
+    assert 'assertEquals(1, value());' in merged
+    # Calls on other objects keep their name
+    assert 'assertEquals(2, this.value2()); other.value();' in merged
+
+
+def test_setup_methods_are_deduplicated_by_body():
+    merged = merge_tests([
+        snippet('ATest', '@BeforeEach public void setUp() { calc = new Calc(); }\n@Test void a() {}'),
+        snippet('BTest', '@BeforeEach void init() { calc = new Calc(); }\n@Test void b() {}')],
+        'CalcGenTest')
+    assert merged.count('@BeforeEach') == 1
+
+
+def test_identical_fields_are_kept_once():
+    merged = merge_tests([
+        snippet('ATest', 'private Calc calc = new Calc();\n@Test void a() { calc.add(); }'),
+        snippet('BTest', 'private Calc calc = new Calc();\n@Test void b() { calc.sub(); }')],
+        'CalcGenTest')
+    assert merged.count('private Calc calc') == 1
+
+
+def test_clashing_fields_are_renamed_with_their_uses():
+    merged = merge_tests([
+        snippet('ATest', 'private Calc calc = new Calc(1);\n@Test void a() { calc.add(); }'),
+        snippet('BTest', 'private Calc calc = new Calc(2);\n@Test void b() { this.calc.sub(calc); other.calc.mul(); }')],
+        'CalcGenTest')
+    assert 'private Calc calc = new Calc(1);' in merged
+    assert 'private Calc calc2 = new Calc(2);' in merged
+    assert 'calc.add();' in merged
+    assert 'this.calc2.sub(calc2); other.calc.mul();' in merged
+
+
+def test_response_without_a_class_is_skipped():
+    merged = merge_tests(['Sorry, I can not do that',
+                          snippet('ATest', '@Test void a() {}')], 'CalcGenTest')
+    assert 'class CalcGenTest {' in merged
+
+
+def test_truncated_member_is_dropped():
+    parsed = members('class ATest {\n@Test void a() {}\n@Test void b() { assertEquals(')
+    assert [member.name for member in parsed] == ['a']
+
+
+def test_members_are_classified():
+    parsed = members('''class ATest {
+    private static final String NAME = "{";
+    @ParameterizedTest
+    @ValueSource(ints = {1, 2})
+    void check(int value) {}
+    static class Helper {}
+    { counter = 0; }
+}''')
+    assert [(member.kind, member.name) for member in parsed] == [
+        ('field', 'NAME'), ('method', 'check'), ('type', 'Helper'), ('block', None)]
+    assert parsed[1].annotations == ['ParameterizedTest', 'ValueSource']
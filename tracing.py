@@ -0,0 +1,164 @@
+# Copyright 2023 Qarik Group
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+import logging
+from logging_config import configure_logging
+configure_logging()
+
+_enabled = False
+_events = []
+_threads = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Span:
+    def __init__(self, name: str, category: str, attributes: dict) -> None:
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.start = 0
+
+    def set(self, **attributes):
+        """Add attributes known only once the span is running, like the size of a response"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter_ns()
+        _local.stack.pop()
+        if exc_type is not None:
+            self.attributes['error'] = f'{exc_type.__name__}: {exc}'
+        thread = threading.current_thread()
+        event = {'name': self.name, 'cat': self.category, 'ph': 'X',
+                 'ts': self.start / 1000, 'dur': (end - self.start) / 1000,
+                 'pid': os.getpid(), 'tid': thread.ident,
+                 'args': self.attributes}
+        with _lock:
+            _events.append(event)
+            _threads[(os.getpid(), thread.ident)] = thread.name
+        return False
+
+
+class _NoSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enable():
+    """Start recording spans"""
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def span(name: str, category: str = 'pipeline', **attributes):
+    """Time a block of code, use it as a context manager. Does nothing unless tracing is enabled
+
+    Args:
+        name (str): name of the span
+        category (str): category shown in the trace viewer
+        attributes: values attached to the span
+
+    Returns:
+        the span, its set() adds more attributes
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, category, attributes)
+
+
+def annotate(**attributes):
+    """Add attributes to the innermost span running on this thread, if any"""
+    stack = getattr(_local, 'stack', None)
+    if _enabled and stack:
+        stack[-1].set(**attributes)
+
+
+def init_worker(enable_tracing: bool):
+    """Initializer for pool processes, drops anything inherited from the parent process
+
+    Args:
+        enable_tracing (bool): if the parent process is tracing
+    """
+    global _enabled
+    _enabled = enable_tracing
+    with _lock:
+        _events.clear()
+        _threads.clear()
+
+
+def drain() -> tuple[list[dict], dict]:
+    """Take the spans recorded so far, to hand them from a pool process back to the parent
+
+    Returns:
+        tuple[list[dict], dict]: trace events, and the thread names they refer to
+    """
+    with _lock:
+        events = list(_events)
+        threads = dict(_threads)
+        _events.clear()
+    return events, threads
+
+
+def merge(events: list[dict], threads: dict):
+    """Add spans recorded by another process
+
+    Args:
+        events (list[dict]): trace events from drain
+        threads (dict): thread names from drain
+    """
+    with _lock:
+        _events.extend(events)
+        _threads.update(threads)
+
+
+def write(path: str):
+    """Write the recorded spans in the Chrome trace event format, for chrome://tracing or Perfetto
+
+    Args:
+        path (str): file to write the trace to
+    """
+    with _lock:
+        events = list(_events)
+        threads = dict(_threads)
+    metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                for (pid, tid), name in threads.items()]
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': metadata + events,
+                  'displayTimeUnit': 'ms'}, file)
+    logging.info(f'Wrote {len(events)} trace spans to {path}')